@@ -3,23 +3,54 @@
 Build the classic ball-in-a-box puzzle, parametrically in build123d style!
 """
 
-import copy
+import sys
+from pathlib import Path
+
 from build123d import *
-from ocp_vscode import *
+
+from model_tools.mesh import tessellate_all, write_stl
+from model_tools.trace import stage
+from model_tools.validate import validate
 
 box_size = 2 * CM  # Change this one parameter to change the whole model!
-ball_radius = box_size / 2
-space_radius = ball_radius * 1.25
 
-with BuildPart() as ball_in_box:
-    box = Box(*[box_size] * 3)
-    gap = Sphere(space_radius, mode=Mode.SUBTRACT)
-    sphere = Sphere(ball_radius)
 
-# Display the model in the VSCode 3D viewer
-show(ball_in_box, reset_camera=Camera.KEEP)
+def build(box_size=box_size):
+    ball_radius = box_size / 2
+    space_radius = ball_radius * 1.25
+
+    with BuildPart() as ball_in_box:
+        with stage("box"):
+            box = Box(*[box_size] * 3)
+        with stage("subtract gap"):
+            gap = Sphere(space_radius, mode=Mode.SUBTRACT)
+        with stage("add ball"):
+            sphere = Sphere(ball_radius)
+
+    ball_in_box.part.label = "ball-in-box"
+    return {"ball-in-box": ball_in_box.part}
+
+
+def show_parts(parts):
+    # Display the model in the VSCode 3D viewer
+    from ocp_vscode import Camera, show
+
+    show(parts["ball-in-box"], reset_camera=Camera.KEEP)
+
+
+def export(parts, output_dir="."):
+    # Export an STL file for 3D printing
+    path = Path(output_dir) / "ball-in-box.stl"
+    with stage("mesh"):
+        meshes = tessellate_all([parts["ball-in-box"]])
+    with stage("validate"):
+        validate(meshes, ["ball-in-box"])
+    with stage("write"):
+        write_stl(path, meshes)
+    return [path]
+
+
+if __name__ == "__main__":
+    from model_tools.cli import main
 
-# Export an STL file for 3D printing
-exporter = Mesher()
-exporter.add_shape(ball_in_box.part)
-exporter.write("ball-in-box.stl")
+    main(sys.modules[__name__])
@@ -6,88 +6,178 @@ well when installed inside a cupboard door with a command strip or other adhesiv
 """
 
 import inspect
+import sys
+from pathlib import Path
+
+# Make the shared model_tools package importable when run as a plain script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
 from build123d import *
-from ocp_vscode import *
+
+from model_tools.mesh import tessellate_all, write_stl
+from model_tools.stages import StageGraph
+from model_tools.svg import import_svg_faces
+from model_tools.trace import stage
+from model_tools.validate import validate
 
 filter_chord = 210 * MM  # corner to corner at the top of the large filter
 wall_thickness = 2 * MM
 inside_depth = 30 * MM
 height = 45 * MM
 top_width = 180 * MM
-bottom_width = (top_width / 2 - height) * 2
+logo_scale = 1 / 4  # original is way too big...
+logo_tolerance = None  # e.g. 0.05 * MM to simplify the logo's curves
 
 src_file_path = inspect.getfile(lambda: None)
 hario_logo = Path.joinpath(Path(src_file_path).parent, "hario-logo.svg")
 
-# These corners define the corners of the trapezoid.
-corners = [
-    (-top_width / 2, height / 2),  # top left
-    (top_width / 2, height / 2),  # top right
-    (bottom_width / 2, -height / 2),  # bottom right
-    (-bottom_width / 2, -height / 2),  # bottom left
-]
-# As the top and bottom will be curvy, these lists define the corners and control points
-# necessary to create the desired Bezier curves.
-top_pts = [corners[0], (height * 1 / 3, height), (0, 0), corners[1]]
-bottom_pts = [
-    corners[3],
-    (0, -height * 1 / 4),
-    (height * 1 / 3, -height * 3 / 4),
-    corners[2],
-]
-
-with BuildPart() as filter_holder:
-    with BuildSketch() as back_sketch:
-        with BuildLine() as back_line:
-            l0 = Bezier(*top_pts)
-            l1 = Line(corners[1], corners[2])
-            l2 = Bezier(*bottom_pts)
-            l3 = Line(corners[3], corners[0])
-        make_face()
-    # Add a flipped copy of the back sketch and loft between them
-    add(back_sketch.face().offset(inside_depth).rotate(Axis.Y, 180))
-    loft()
-
-    # Insert a "coffee filter" shape to cut out the inside
-    with BuildSketch(Plane.XY.offset(-wall_thickness)) as inside_sketch:
-        with BuildLine() as filter_line:
-            corners = [
-                (
-                    -filter_chord / 2,
-                    -top_width / 2 + height / 2 + filter_chord / 2,
-                ),  # top left
-                (0, -top_width / 2 + height / 2),  # bottom_point
-                (
-                    filter_chord / 2,
-                    -top_width / 2 + height / 2 + filter_chord / 2,
-                ),  # top right
-            ]
-            # corners.append(corners[0])
-            corners = [(x, y + wall_thickness * 2 ** (1 / 2)) for x, y in corners]
-            l0 = Polyline(*corners)
-            l1 = ThreePointArc(corners[0], (0, corners[0][-1] + 35 * MM), corners[-1])
-        make_face()
-    filter_block = extrude(
-        amount=-inside_depth + wall_thickness * 2, mode=Mode.SUBTRACT
+
+# The holder is built in stages, so changing a parameter only rebuilds the stages that
+# depend on it: e.g. a new logo_scale reuses the loft and the filter cut as they were.
+stages = StageGraph()
+
+
+@stages.stage
+def loft_body(height, top_width, inside_depth):
+    bottom_width = (top_width / 2 - height) * 2
+
+    # These corners define the corners of the trapezoid.
+    corners = [
+        (-top_width / 2, height / 2),  # top left
+        (top_width / 2, height / 2),  # top right
+        (bottom_width / 2, -height / 2),  # bottom right
+        (-bottom_width / 2, -height / 2),  # bottom left
+    ]
+    # As the top and bottom will be curvy, these lists define the corners and control
+    # points necessary to create the desired Bezier curves.
+    top_pts = [corners[0], (height * 1 / 3, height), (0, 0), corners[1]]
+    bottom_pts = [
+        corners[3],
+        (0, -height * 1 / 4),
+        (height * 1 / 3, -height * 3 / 4),
+        corners[2],
+    ]
+
+    with BuildPart() as body:
+        with BuildSketch() as back_sketch:
+            with BuildLine() as back_line:
+                l0 = Bezier(*top_pts)
+                l1 = Line(corners[1], corners[2])
+                l2 = Bezier(*bottom_pts)
+                l3 = Line(corners[3], corners[0])
+            make_face()
+        # Add a flipped copy of the back sketch and loft between them
+        add(back_sketch.face().offset(inside_depth).rotate(Axis.Y, 180))
+        loft()
+    return body.part
+
+
+@stages.stage
+def filter_block(filter_chord, wall_thickness, inside_depth, height, top_width):
+    # A "coffee filter" shape to cut out the inside
+    with BuildPart():
+        with BuildSketch(Plane.XY.offset(-wall_thickness)) as inside_sketch:
+            with BuildLine() as filter_line:
+                corners = [
+                    (
+                        -filter_chord / 2,
+                        -top_width / 2 + height / 2 + filter_chord / 2,
+                    ),  # top left
+                    (0, -top_width / 2 + height / 2),  # bottom_point
+                    (
+                        filter_chord / 2,
+                        -top_width / 2 + height / 2 + filter_chord / 2,
+                    ),  # top right
+                ]
+                # corners.append(corners[0])
+                corners = [(x, y + wall_thickness * 2 ** (1 / 2)) for x, y in corners]
+                l0 = Polyline(*corners)
+                l1 = ThreePointArc(
+                    corners[0], (0, corners[0][-1] + 35 * MM), corners[-1]
+                )
+            make_face()
+        filters = extrude(amount=-inside_depth + wall_thickness * 2)
+    return filters
+
+
+# The stage's key only covers its own source, so svg.py is declared too, for changes to
+# how the logo is imported or simplified to rebuild the engraving
+@stages.stage(files=[hario_logo, inspect.getsourcefile(import_svg_faces)])
+def logo_block(wall_thickness, logo_scale, logo_tolerance):
+    # The Hario logo, to engrave into the front
+    with stage("logo import"):
+        # The scaled logo is also cached by itself, so the SVG is only parsed when it
+        # changes
+        logo = import_svg_faces(hario_logo, scale=logo_scale, tolerance=logo_tolerance)
+    with BuildPart():
+        with BuildSketch() as logo_sketch:
+            add(logo)
+        engraving = extrude(amount=-wall_thickness / 2)
+    return engraving
+
+
+@stages.stage
+def hollow_body(loft_body, filter_block):
+    with stage("filter cut"):
+        return loft_body - filter_block
+
+
+@stages.stage
+def filter_holder(hollow_body, logo_block):
+    with stage("logo cut"):
+        return hollow_body - logo_block
+
+
+def build(
+    filter_chord=filter_chord,
+    wall_thickness=wall_thickness,
+    inside_depth=inside_depth,
+    height=height,
+    top_width=top_width,
+    logo_scale=logo_scale,
+    logo_tolerance=logo_tolerance,
+):
+    parts = stages.run(
+        filter_chord=filter_chord,
+        wall_thickness=wall_thickness,
+        inside_depth=inside_depth,
+        height=height,
+        top_width=top_width,
+        logo_scale=logo_scale,
+        logo_tolerance=logo_tolerance,
     )
+    filter_holder = parts["filter_holder"]
+    filters = parts["filter_block"]
+    filter_holder.label = "filter-holder"
+    filters.label = "filters"
+    return {"filter-holder": filter_holder, "filters": filters}
+
+
+def show_parts(parts):
+    # Display the part in the GUI as it would be used with filters
+    from ocp_vscode import Camera, show
+
+    show(
+        parts["filter-holder"],
+        parts["filters"],
+        colors=["goldenrod", "silver"],
+        reset_camera=Camera.KEEP,
+    )
+
+
+def export(parts, output_dir="."):
+    # Export the STL for printing
+    path = Path(output_dir) / "coffee-filter-holder.stl"
+    with stage("mesh"):
+        meshes = tessellate_all([parts["filter-holder"]])
+    with stage("validate"):
+        validate(meshes, ["filter-holder"])
+    with stage("write"):
+        write_stl(path, meshes)
+    return [path]
+
+
+if __name__ == "__main__":
+    from model_tools.cli import main
 
-    # Add the Hario logo to the front
-    logo_svg = import_svg(hario_logo)
-    with BuildSketch() as logo_sketch:
-        add(logo_svg.faces())
-        scale(by=1 / 4)  # original is way too big...
-    extrude(amount=-wall_thickness / 2, mode=Mode.SUBTRACT)
-
-# Display the part in the GUI as it would be used with filters
-filter_holder.label = "filter-holder"
-filter_block.label = "filters"
-
-show(
-    filter_holder,
-    filter_block,
-    colors=["goldenrod", "silver"],
-    reset_camera=Camera.KEEP,
-)
-
-# Export the STL for printing
-filter_holder.part.export_stl("coffee-filter-holder.stl")
+    main(sys.modules[__name__])
@@ -3,32 +3,68 @@
 This is Jern's version, which is much simpler than mine, and neater, but doesn't include my curvy design elements.
 """
 
+import sys
+from pathlib import Path
+
+# Make the shared model_tools package importable when run as a plain script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
 from build123d import *
-from ocp_vscode import *
+
+from model_tools.mesh import tessellate_all, write_stl
+from model_tools.trace import stage
+from model_tools.validate import validate
 
 filter_rad = 148.4924240491749
 inside_depth = 30 * MM
-outside_depth = inside_depth + 4
 ms = Mode.SUBTRACT
 
-with BuildSketch() as s_filter:
-    with BuildLine() as l:  # Plane((0,-65))
-        m1 = PolarLine((0, 0), filter_rad, 45)
-        m3 = RadiusArc((0, filter_rad), m1 @ 1, filter_rad)
-        # sagitta is a bit different but not relevant to this model
-        mirror(about=Plane.YZ)
-    make_face()
-
-with BuildPart() as p:
-    ofs = offset(s_filter.sketch, amount=2)
-    extrude(amount=outside_depth / 2, both=True)
-    # replace splits with nicer cuts (how??)
-    split(bisect_by=Plane.XZ.offset(-50), keep=Keep.BOTTOM)
-    split(bisect_by=Plane.XZ.offset(-80), keep=Keep.TOP)
-    add(s_filter.sketch)
-    extrude(amount=inside_depth / 2, both=True, mode=ms)
-
-s_filter.label = "filter"
-p.label = "filter-holder"
-
-show(p, s_filter)
+
+def build(filter_rad=filter_rad, inside_depth=inside_depth):
+    outside_depth = inside_depth + 4
+
+    with stage("sketch"):
+        with BuildSketch() as s_filter:
+            with BuildLine() as l:  # Plane((0,-65))
+                m1 = PolarLine((0, 0), filter_rad, 45)
+                m3 = RadiusArc((0, filter_rad), m1 @ 1, filter_rad)
+                # sagitta is a bit different but not relevant to this model
+                mirror(about=Plane.YZ)
+            make_face()
+
+    with stage("part"):
+        with BuildPart() as p:
+            ofs = offset(s_filter.sketch, amount=2)
+            extrude(amount=outside_depth / 2, both=True)
+            # replace splits with nicer cuts (how??)
+            split(bisect_by=Plane.XZ.offset(-50), keep=Keep.BOTTOM)
+            split(bisect_by=Plane.XZ.offset(-80), keep=Keep.TOP)
+            add(s_filter.sketch)
+            extrude(amount=inside_depth / 2, both=True, mode=ms)
+
+    s_filter.sketch.label = "filter"
+    p.part.label = "filter-holder"
+    return {"filter-holder": p.part, "filter": s_filter.sketch}
+
+
+def show_parts(parts):
+    from ocp_vscode import show
+
+    show(parts["filter-holder"], parts["filter"])
+
+
+def export(parts, output_dir="."):
+    path = Path(output_dir) / "coffee-filter-holder-by-jern.stl"
+    with stage("mesh"):
+        meshes = tessellate_all([parts["filter-holder"]])
+    with stage("validate"):
+        validate(meshes, ["filter-holder"])
+    with stage("write"):
+        write_stl(path, meshes)
+    return [path]
+
+
+if __name__ == "__main__":
+    from model_tools.cli import main
+
+    main(sys.modules[__name__])
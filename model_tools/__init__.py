@@ -0,0 +1,7 @@
+"""
+Shared helpers for building, caching and exporting the models in this repository.
+
+Nothing in here imports build123d (or the viewer) at import time, so the helpers can be
+used from light-weight tooling without paying for OCC start up. The exception is
+``topology``, which only makes sense once there are build123d shapes around.
+"""
@@ -0,0 +1,245 @@
+"""
+Benchmark every stage of every model, so slow downs from code changes or build123d/OCP
+upgrades can be spotted.
+
+Each case is run a number of times with the part cache disabled, and the time of every
+stage recorded by ``model_tools.trace`` (sketch, extrude, fillet, chamfer, loft, logo cut,
+booleans, tessellation, writing...) is aggregated into statistics. There are also scaling
+cases building ``make_grid`` with more and more cells, both cutting the cells out in one
+boolean and (named "sequential") cutting them out of the sketch. Results are saved as
+JSON, and two result files can be compared, flagging the stages that got slower than a
+threshold::
+
+    python -m model_tools.bench run -o before.json
+    # ... upgrade build123d, or change some code ...
+    python -m model_tools.bench run -o after.json
+    python -m model_tools.bench compare before.json after.json --threshold 0.15
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from model_tools import trace
+from model_tools.cache import library_versions, part_cache
+from model_tools.cli import load_model, model_params
+
+MODELS = [
+    "ball_in_a_box",
+    "coffee_filter_holder.coffee_filter_holder",
+    "coffee_filter_holder.coffee_filter_holder_by_jern",
+    "terraforming_mars.player_mat",
+]
+
+# (x_count, y_count) for the make_grid scaling cases. Cutting the cells one sketch
+# operation at a time is too slow to be worth timing beyond a few hundred cells.
+GRID_SIZES = [(6, 3), (12, 6), (24, 12), (48, 24)]
+SEQUENTIAL_GRID_SIZES = [(6, 3), (12, 6), (24, 12)]
+
+# Ignore differences smaller than this, they are just noise
+MIN_DIFFERENCE = 0.005
+
+
+def model_case(name):
+    """A case building and exporting a whole model"""
+
+    def run():
+        model = load_model(name)
+        with tempfile.TemporaryDirectory() as output_dir:
+            with trace.stage("build"):
+                parts = model.build(**model_params(model))
+            with trace.stage("export"):
+                model.export(parts, output_dir)
+
+    return name, run
+
+
+def grid_params(x_count, y_count):
+    """The big grid parameters, stretched to fit x_count by y_count cells"""
+    grid_vars = dict(load_model("terraforming_mars.player_mat").big_grid_vars)
+    # Keep the same gaps between the cells, and around the edges
+    cell_gap = grid_vars["x_spacing"] - grid_vars["cell_size"]
+    x_margin = (
+        grid_vars["long_side"]
+        - grid_vars["left_area_long_side"]
+        - grid_vars["right_area_long_side"]
+    )
+    y_margin = grid_vars["short_side"] - grid_vars["y_spacing"] * grid_vars["y_count"]
+    left_area_long_side = grid_vars["x_spacing"] * (x_count - 1) + cell_gap
+    grid_vars.update(
+        x_count=x_count,
+        y_count=y_count,
+        left_area_long_side=left_area_long_side,
+        long_side=left_area_long_side + grid_vars["right_area_long_side"] + x_margin,
+        short_side=grid_vars["y_spacing"] * y_count + y_margin,
+    )
+    return grid_vars
+
+
+def grid_case(x_count, y_count, batch_cells=True):
+    """A scaling case building a grid of x_count by y_count cells"""
+
+    def run():
+        player_mat = load_model("terraforming_mars.player_mat")
+        with trace.stage("make_grid"):
+            player_mat.make_grid(**params, batch_cells=batch_cells)
+
+    params = grid_params(x_count, y_count)
+    name = f"make_grid {x_count}x{y_count}"
+    return (name if batch_cells else f"{name} sequential"), run
+
+
+def all_cases():
+    return (
+        [model_case(name) for name in MODELS]
+        + [grid_case(x, y) for x, y in GRID_SIZES]
+        + [grid_case(x, y, batch_cells=False) for x, y in SEQUENTIAL_GRID_SIZES]
+    )
+
+
+def summarize(samples):
+    return {
+        "n": len(samples),
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "max": max(samples),
+    }
+
+
+def run_case(run, repeat=5, warmup=1):
+    """Run a case, returning {stage path: statistics} over the timed repeats"""
+    samples = defaultdict(list)
+    for i in range(warmup + repeat):
+        trace.reset()
+        start = time.perf_counter()
+        run()
+        total = time.perf_counter() - start
+        if i < warmup:
+            continue
+        samples["total"].append(total)
+        # A stage can be run several times in one go, so add those up
+        per_run = defaultdict(float)
+        for path, seconds in trace.stage_paths():
+            per_run[path] += seconds
+        for path, seconds in per_run.items():
+            samples[path].append(seconds)
+    return {path: summarize(values) for path, values in samples.items()}
+
+
+def run_benchmarks(repeat=5, warmup=1, match=None):
+    part_cache.enabled = False  # we want to time the building, not the cache
+    trace.enabled = True
+    results = {}
+    for name, run in all_cases():
+        if match and match not in name:
+            continue
+        print(f"Running {name}...", file=sys.stderr)
+        for path, stats in run_case(run, repeat, warmup).items():
+            results[f"{name}: {path}"] = stats
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "versions": library_versions(),
+            "repeat": repeat,
+            "warmup": warmup,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=0.1):
+    """Compare the medians of two result sets
+
+    Returns (rows, regressions) where each row is (metric, old, new, ratio) and the
+    regressions are the rows that got slower by more than threshold (0.1 = 10%).
+    """
+    rows = []
+    regressions = []
+    for metric, new in current["results"].items():
+        old = baseline["results"].get(metric)
+        if old is None:
+            continue
+        ratio = new["median"] / old["median"] if old["median"] else float("inf")
+        row = (metric, old["median"], new["median"], ratio)
+        rows.append(row)
+        if ratio > 1 + threshold and new["median"] - old["median"] > MIN_DIFFERENCE:
+            regressions.append(row)
+    return rows, regressions
+
+
+def print_results(results, file=None):
+    file = file or sys.stdout
+    width = max(len(metric) for metric in results["results"])
+    print(f"{'':<{width}}  {'median':>9}  {'min':>9}  {'stdev':>9}", file=file)
+    for metric, stats in results["results"].items():
+        print(
+            f"{metric:<{width}}  {stats['median']:9.4f}  {stats['min']:9.4f}  "
+            f"{stats['stdev']:9.4f}",
+            file=file,
+        )
+
+
+def print_comparison(rows, regressions, file=None):
+    file = file or sys.stdout
+    width = max((len(row[0]) for row in rows), default=0)
+    for metric, old, new, ratio in rows:
+        flag = "  REGRESSION" if (metric, old, new, ratio) in regressions else ""
+        print(
+            f"{metric:<{width}}  {old:9.4f}  {new:9.4f}  {ratio:6.2f}x{flag}", file=file
+        )
+    print(f"{len(regressions)} regression(s)", file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m model_tools.bench",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("-n", "--repeat", type=int, default=5)
+    run_parser.add_argument("--warmup", type=int, default=1)
+    run_parser.add_argument("-k", "--match", help="only run cases containing this")
+    run_parser.add_argument("-o", "--output", type=Path, help="save results as JSON")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="flag stages slower by more than this fraction (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run_benchmarks(args.repeat, args.warmup, args.match)
+        print_results(results)
+        if args.output:
+            args.output.write_text(json.dumps(results, indent=2) + "\n")
+            print(f"Wrote {args.output}", file=sys.stderr)
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    current = json.loads(args.current.read_text())
+    rows, regressions = compare(baseline, current, args.threshold)
+    print_comparison(rows, regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
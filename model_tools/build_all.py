@@ -0,0 +1,564 @@
+"""
+Build every model in the repository, only rebuilding the ones whose inputs changed.
+
+The models are found by looking for scripts with module level ``build()`` and
+``export()`` functions. Scripts generating files that models are built from, like
+player_mat_parser.py writing the parameters player_mat.py reads, are listed in
+GENERATORS, and run before the models depending on them::
+
+    python -m model_tools.build_all -o build
+    python -m model_tools.build_all -o build -j 2 coffee_filter_holder
+    python -m model_tools.build_all -o build --dry-run
+
+Each target's inputs are hashed: its script, the repository modules it imports (found
+by reading the imports, not by importing anything), the SVG, STL and JSON files those
+modules name, and the settings and library versions it's built with. The default
+parameters of a model are in its script or in those files, so they're hashed along with
+them. The files a model writes aren't among its inputs, even when written next to it,
+and neither is the manifest. A target is only rebuilt when that hash changed since it
+was last built, or one of the files it wrote is missing, so after changing one file only
+what depends on it is rebuilt. The independent targets are built in parallel, each
+model into its own directory under --output-dir, where a manifest of the hashes,
+outputs and build times is kept.
+"""
+
+import argparse
+import ast
+import inspect
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from importlib import metadata
+from pathlib import Path
+
+from model_tools.cache import file_sha256, hash_params
+from model_tools.cli import REPO_ROOT, load_model, model_params
+from model_tools.mesh import QUALITY_PROFILES, set_quality
+from model_tools.validate import VALIDATION_MODES, set_validation, validation
+
+MANIFEST_NAME = "build_manifest.json"
+# The files a module may read while building, if it names them
+ASSET_SUFFIXES = (".svg", ".stl", ".json")
+# The settings that change what's written, unlike e.g. how the meshes are validated
+OUTPUT_SETTINGS = ("quality", "adaptive", "formats")
+# Directories that don't hold models
+SKIPPED_DIRS = ("model_tools", "__pycache__")
+
+# {script: (arguments, sources, outputs)} of the scripts generating files that models are
+# built from. They have no build() to find them by, so they're listed here. The runner
+# already knows they're stale, so the parser is told to re-parse everything.
+GENERATORS = {
+    "terraforming_mars/player_mat_parser.py": (
+        ["--force"],
+        [
+            "terraforming_mars/files/aimfeld/player-mat-parts_-_body.stl",
+            "terraforming_mars/files/aimfeld/player-mat-parts_-_grid_big.stl",
+            "terraforming_mars/files/aimfeld/player-mat-parts_-_grid_small.stl",
+        ],
+        ["terraforming_mars/player_mat_params.json"],
+    ),
+}
+
+# kind: "model" or "generator". inputs and outputs are paths relative to the repository,
+# although the outputs of models are only known once they've been built.
+Target = namedtuple("Target", "name kind script arguments inputs outputs")
+# status: "built", "up to date", "failed", "skipped", "kept" or (in a dry run) "stale"
+Result = namedtuple("Result", "name status seconds outputs message")
+
+
+def module_name(script):
+    return ".".join(Path(script).with_suffix("").parts)
+
+
+def defines_model(path):
+    """Whether a script has module level build() and export() functions"""
+    try:
+        tree = ast.parse(path.read_text(encoding="utf-8"), str(path))
+    except SyntaxError as exc:
+        print(f"Warning: skipping {path}: {exc}", file=sys.stderr)
+        return False
+    functions = {node.name for node in tree.body if isinstance(node, ast.FunctionDef)}
+    return {"build", "export"} <= functions
+
+
+def module_path(name):
+    """The file of a module in the repository, or None if it's from elsewhere"""
+    base = REPO_ROOT.joinpath(*name.split("."))
+    for path in (base.with_suffix(".py"), base / "__init__.py"):
+        if path.is_file():
+            return path
+    return None
+
+
+def repo_imports(script):
+    """The script and every repository module it imports, directly or not, including
+    the imports inside functions"""
+    found = set()
+    pending = [Path(script)]
+    while pending:
+        path = pending.pop()
+        if path in found:
+            continue
+        found.add(path)
+        names = []
+        for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"), str(path))):
+            if isinstance(node, ast.Import):
+                names += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names.append(node.module)
+                # "from package import module" imports a module too
+                names += [f"{node.module}.{alias.name}" for alias in node.names]
+        for name in names:
+            parts = name.split(".")
+            # The packages are imported along with their modules
+            for i in range(1, len(parts) + 1):
+                module = module_path(".".join(parts[:i]))
+                if module is not None:
+                    pending.append(module)
+    return found
+
+
+def named_assets(path):
+    """The files next to a module that it names, like the logo the coffee filter holder
+    engraves. The names in export() are of the files it writes, so they're left out."""
+    tree = ast.parse(path.read_text(encoding="utf-8"), str(path))
+    exported = {
+        id(node)
+        for function in tree.body
+        if isinstance(function, ast.FunctionDef) and function.name == "export"
+        for node in ast.walk(function)
+    }
+    assets = set()
+    for node in ast.walk(tree):
+        if (
+            id(node) in exported
+            or not isinstance(node, ast.Constant)
+            or not isinstance(node.value, str)
+            or "\n" in node.value
+            or Path(node.value).suffix not in ASSET_SUFFIXES
+        ):
+            continue
+        asset = path.parent / node.value
+        try:
+            if asset.is_file():
+                assets.add(asset.resolve())
+        except (OSError, ValueError):
+            # Not a file name after all
+            pass
+    return assets
+
+
+def script_inputs(script, exclude=()):
+    """The files a script's outputs depend on, relative to the repository"""
+    paths = repo_imports(REPO_ROOT / script)
+    for module in list(paths):
+        paths.update(
+            asset for asset in named_assets(module) if asset.is_relative_to(REPO_ROOT)
+        )
+    return sorted(
+        path.relative_to(REPO_ROOT).as_posix()
+        for path in paths
+        if path.relative_to(REPO_ROOT).as_posix() not in exclude
+    )
+
+
+def discover():
+    """Every generator and model in the repository, in the order to build them"""
+    targets = []
+    for script, (arguments, sources, outputs) in GENERATORS.items():
+        # A generator's module names its own outputs, but they aren't its inputs
+        inputs = sorted(set(script_inputs(script, outputs)) | set(sources))
+        targets.append(
+            Target(module_name(script), "generator", script, arguments, inputs, outputs)
+        )
+    for path in sorted(REPO_ROOT.rglob("*.py")):
+        script = path.relative_to(REPO_ROOT)
+        if script.as_posix() in GENERATORS or any(
+            part.startswith(".") or part in SKIPPED_DIRS for part in script.parts
+        ):
+            continue
+        if defines_model(path):
+            script = script.as_posix()
+            targets.append(
+                Target(
+                    module_name(script), "model", script, [], script_inputs(script), []
+                )
+            )
+    return targets
+
+
+def dependencies(targets):
+    """{name: names of the targets whose outputs it's built from}"""
+    producers = {output: target.name for target in targets for output in target.outputs}
+    return {
+        target.name: sorted(
+            {producers[path] for path in target.inputs if path in producers}
+        )
+        for target in targets
+    }
+
+
+def package_versions():
+    """The versions of the geometry libraries, read without importing them, as that
+    takes longer than checking everything is up to date"""
+    versions = {}
+    for name in ("build123d", "cadquery-ocp"):
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def own_files(target, output_dir, entry):
+    """The files a target writes, including the manifest, which may be where its inputs
+    are (e.g. with --output-dir .), but mustn't be hashed along with them"""
+    output_dir = Path(output_dir).resolve()
+    paths = {output_dir / MANIFEST_NAME}
+    paths.update(Path(path).resolve() for path in (entry or {}).get("outputs", []))
+    paths.update(REPO_ROOT / path for path in target.outputs)
+    model_dir = (
+        output_dir / Path(target.script).stem if target.kind == "model" else None
+    )
+    return {
+        path.relative_to(REPO_ROOT).as_posix()
+        for path in map(REPO_ROOT.joinpath, target.inputs)
+        if path in paths or (model_dir and path.is_relative_to(model_dir))
+    }
+
+
+def target_key(target, settings, versions, exclude=()):
+    """The hash of everything a target's outputs depend on"""
+    hashes = {}
+    for path in target.inputs:
+        if path in exclude:
+            continue
+        try:
+            hashes[path] = file_sha256(REPO_ROOT / path)
+        except FileNotFoundError:
+            hashes[path] = None
+    settings = {name: settings[name] for name in OUTPUT_SETTINGS}
+    return hash_params(target.name, target.arguments, settings, versions, hashes)
+
+
+def missing_sources(target):
+    return [path for path in target.inputs if not (REPO_ROOT / path).exists()]
+
+
+def load_manifest(output_dir):
+    try:
+        with open(Path(output_dir) / MANIFEST_NAME, encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest, output_dir):
+    # Written to a temporary file and moved in place, so an interrupted run never
+    # leaves half a manifest
+    fd, tmp_name = tempfile.mkstemp(dir=output_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        manifest_file.write("\n")
+    os.replace(tmp_name, Path(output_dir) / MANIFEST_NAME)
+
+
+def up_to_date(entry, key):
+    return (
+        entry is not None
+        and entry.get("key") == key
+        and all(Path(path).exists() for path in entry.get("outputs", []))
+    )
+
+
+def build_target(target, output_dir, settings):
+    """Worker function: build a target, returning the paths it wrote and how long it
+    took, not counting the time it waited for a worker"""
+    start = time.perf_counter()
+    if target.kind == "generator":
+        # Generators are command line scripts, and are run as such
+        process = subprocess.run(
+            [sys.executable, str(REPO_ROOT / target.script), *target.arguments],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode:
+            raise RuntimeError(
+                f"{target.script} exited with {process.returncode}:\n"
+                + process.stderr[-2000:]
+            )
+        paths = [REPO_ROOT / path for path in target.outputs]
+        return [str(path) for path in paths], time.perf_counter() - start
+
+    model = load_model(str(REPO_ROOT / target.script))
+    set_quality(settings["quality"], settings["adaptive"])
+    set_validation(settings["validate"])
+    parts = model.build(**model_params(model))
+    model_dir = Path(output_dir) / Path(target.script).stem
+    model_dir.mkdir(parents=True, exist_ok=True)
+    export_kwargs = {}
+    if settings["formats"] and "formats" in inspect.signature(model.export).parameters:
+        export_kwargs["formats"] = settings["formats"]
+    paths = model.export(parts, model_dir, **export_kwargs)
+    return [str(path) for path in paths], time.perf_counter() - start
+
+
+def remove_stale_outputs(entry, outputs):
+    """Remove the files a target wrote last time but not this time, e.g. plates of a
+    layout that now fits on fewer"""
+    if entry is None:
+        return
+    for path in set(entry.get("outputs", [])) - set(outputs):
+        Path(path).unlink(missing_ok=True)
+
+
+def build_all(
+    targets, output_dir, settings, processes=None, force=False, dry_run=False
+):
+    """Build the stale targets, the independent ones in parallel, returning a Result
+    for every target in order"""
+    output_dir = Path(output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    versions = package_versions()
+    depends_on = dependencies(targets)
+    processes = processes or os.cpu_count() or 1
+
+    results = {}
+    pending = list(targets)
+    running = {}
+    pool = None
+    try:
+        while pending or running:
+            for target in list(pending):
+                if any(name not in results for name in depends_on[target.name]):
+                    continue
+                pending.remove(target)
+                statuses = {
+                    name: results[name].status for name in depends_on[target.name]
+                }
+                failed = [
+                    name
+                    for name, status in statuses.items()
+                    if status in ("failed", "skipped")
+                ]
+                if failed:
+                    results[target.name] = Result(
+                        target.name, "skipped", 0.0, [], f"{failed[0]} failed"
+                    )
+                    continue
+                stale = [name for name, status in statuses.items() if status == "stale"]
+                if stale:
+                    # In a dry run nothing is regenerated, so hashing the inputs would
+                    # find the ones from last time
+                    results[target.name] = Result(
+                        target.name, "stale", 0.0, [], f"{stale[0]} would be rebuilt"
+                    )
+                    continue
+                # Hashed only now, as its inputs may have just been regenerated
+                entry = manifest.get(target.name)
+                key = target_key(
+                    target, settings, versions, own_files(target, output_dir, entry)
+                )
+                if not force and up_to_date(entry, key):
+                    results[target.name] = Result(
+                        target.name,
+                        "up to date",
+                        entry.get("seconds", 0.0),
+                        entry["outputs"],
+                        "",
+                    )
+                    continue
+                missing = missing_sources(target)
+                if missing and target.kind == "generator":
+                    # e.g. the aimfeld models, which aren't in the repository
+                    kept = all((REPO_ROOT / path).exists() for path in target.outputs)
+                    results[target.name] = Result(
+                        target.name,
+                        "kept" if kept else "failed",
+                        0.0,
+                        [],
+                        f"{missing[0]} is missing"
+                        + (", so the existing outputs are used" if kept else ""),
+                    )
+                    continue
+                if dry_run:
+                    results[target.name] = Result(
+                        target.name, "stale", 0.0, [], "would be rebuilt"
+                    )
+                    continue
+                if pool is None:
+                    pool = ProcessPoolExecutor(max_workers=processes)
+                print(f"Building {target.name}", file=sys.stderr)
+                future = pool.submit(build_target, target, output_dir, settings)
+                running[future] = (target, key)
+
+            if not running:
+                if pending and not any(
+                    all(name in results for name in depends_on[target.name])
+                    for target in pending
+                ):
+                    raise RuntimeError(
+                        "Circular dependencies between "
+                        + ", ".join(target.name for target in pending)
+                    )
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                target, key = running.pop(future)
+                try:
+                    outputs, seconds = future.result()
+                except Exception as exc:
+                    print(f"{target.name} failed: {exc}", file=sys.stderr)
+                    results[target.name] = Result(
+                        target.name,
+                        "failed",
+                        0.0,
+                        [],
+                        f"{type(exc).__name__}: {exc}",
+                    )
+                    manifest.pop(target.name, None)
+                else:
+                    remove_stale_outputs(manifest.get(target.name), outputs)
+                    results[target.name] = Result(
+                        target.name, "built", seconds, outputs, ""
+                    )
+                    manifest[target.name] = {
+                        "key": key,
+                        "outputs": outputs,
+                        "seconds": round(seconds, 3),
+                    }
+                # Saved after every target, so an interrupted run keeps what it built
+                save_manifest(manifest, output_dir)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return [results[target.name] for target in targets]
+
+
+def report(results, seconds, file=None):
+    """Print what was built, and how long it took"""
+    file = file or sys.stderr
+    width = max(len(result.name) for result in results)
+    print("\nBuild summary:", file=file)
+    for result in results:
+        timing = ""
+        if result.status == "built":
+            timing = f"{result.seconds:.1f}s"
+        elif result.status == "up to date":
+            # How long its last build took, for comparison
+            timing = f"({result.seconds:.1f}s)"
+        line = f"  {result.name:{width}}  {result.status:10}  {timing:>8}"
+        if result.message:
+            line += f"  {result.message.splitlines()[0]}"
+        print(line.rstrip(), file=file)
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    build_seconds = sum(r.seconds for r in results if r.status == "built")
+    print(
+        ", ".join(f"{count} {status}" for status, count in counts.items())
+        + f" in {seconds:.1f}s ({build_seconds:.1f}s of building)",
+        file=file,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m model_tools.build_all",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="only build the targets whose names contain one of these (and what they "
+        "depend on)",
+    )
+    parser.add_argument(
+        "-o", "--output-dir", type=Path, default=Path("build"), help="(default: build)"
+    )
+    parser.add_argument(
+        "-j", "--processes", type=int, help="worker processes (default: one per CPU)"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="rebuild everything, even if up to date"
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="only list the targets that would be rebuilt",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        dest="formats",
+        action="append",
+        choices=["stl", "3mf"],
+        help="file format(s) to export, for the models that support choosing",
+    )
+    parser.add_argument(
+        "-q",
+        "--quality",
+        choices=list(QUALITY_PROFILES),
+        default=os.environ.get("MODEL_QUALITY"),
+    )
+    parser.add_argument("--adaptive", action="store_true")
+    parser.add_argument(
+        "--validate", choices=VALIDATION_MODES, default=validation["mode"]
+    )
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    targets = discover()
+    if args.targets:
+        depends_on = dependencies(targets)
+        wanted = {
+            target.name
+            for target in targets
+            if any(pattern in target.name for pattern in args.targets)
+        }
+        if not wanted:
+            parser.error(
+                "no targets match; they are "
+                + ", ".join(target.name for target in targets)
+            )
+        pending = list(wanted)
+        while pending:
+            for name in depends_on[pending.pop()]:
+                if name not in wanted:
+                    wanted.add(name)
+                    pending.append(name)
+        targets = [target for target in targets if target.name in wanted]
+
+    settings = {
+        "quality": args.quality,
+        "adaptive": args.adaptive,
+        "formats": args.formats,
+        "validate": args.validate,
+    }
+    results = build_all(
+        targets,
+        args.output_dir,
+        settings,
+        processes=args.processes,
+        force=args.force,
+        dry_run=args.dry_run,
+    )
+    for result in results:
+        if result.status == "built":
+            for path in result.outputs:
+                print(f"Wrote {path}")
+    report(results, time.perf_counter() - start)
+    return 1 if any(result.status == "failed" for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+A persistent, content-addressed cache of built parts.
+
+Parts are stored as BREP files named by a SHA-256 of everything that went into building
+them: the function's qualified name and source, the parameters it was called with and the
+installed build123d/OCP versions. A hit just reads the BREP back in, which is orders of
+magnitude cheaper than redoing the booleans, fillets and chamfers.
+
+The cache directory is kept under a size limit by evicting the least recently used files,
+where "used" is tracked with the file modification time (touched on every hit).
+
+Bypass the cache by setting ``MODEL_CACHE=off`` in the environment, setting
+``part_cache.enabled = False``, or by calling the undecorated ``func.__wrapped__``.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+from pathlib import Path
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def default_cache_dir():
+    """Where to keep the cache, honouring MODEL_CACHE_DIR and XDG_CACHE_HOME"""
+    if "MODEL_CACHE_DIR" in os.environ:
+        return Path(os.environ["MODEL_CACHE_DIR"])
+    xdg = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(xdg) / "my-3d-models"
+
+
+def library_versions():
+    """The versions of the geometry libraries, as they affect the built shapes"""
+    import build123d
+    import OCP
+
+    return {
+        "build123d": getattr(build123d, "__version__", "unknown"),
+        "OCP": getattr(OCP, "__version__", "unknown"),
+    }
+
+
+def file_sha256(path):
+    """The SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_params(*parts):
+    """Return a stable SHA-256 hex digest of some JSON-able (or repr-able) values"""
+    data = json.dumps(parts, sort_keys=True, default=repr)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class PartCache:
+    """Disk-backed LRU cache of shapes, stored as BREP files"""
+
+    def __init__(self, directory=None, max_bytes=None, enabled=None):
+        self.directory = Path(directory or default_cache_dir()) / "parts"
+        if max_bytes is None:
+            max_mb = os.environ.get("MODEL_CACHE_MAX_MB")
+            max_bytes = int(max_mb) * 1024 * 1024 if max_mb else DEFAULT_MAX_BYTES
+        self.max_bytes = max_bytes
+        if enabled is None:
+            enabled = os.environ.get("MODEL_CACHE", "on").lower() not in (
+                "0",
+                "off",
+                "false",
+                "no",
+            )
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, func, params):
+        """The cache key for calling func with the given parameter dict"""
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = None
+        return hash_params(
+            func.__module__, func.__qualname__, source, params, library_versions()
+        )
+
+    def path(self, key):
+        return self.directory / f"{key}.brep"
+
+    def get(self, key):
+        """Return the cached shape for key, or None if it isn't cached"""
+        from build123d import import_brep
+
+        path = self.path(key)
+        try:
+            shape = import_brep(path)
+        except ValueError:
+            return None
+        # Mark it as recently used for the LRU eviction
+        os.utime(path)
+        return shape
+
+    def put(self, key, shape):
+        """Store shape under key, then trim the cache back down to size"""
+        from build123d import export_brep
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file and move it in place, so concurrent builds never
+        # see half written files.
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            export_brep(shape, tmp_name)
+            os.replace(tmp_name, self.path(key))
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for path in self.directory.glob("*.brep"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        for path in self.directory.glob("*.brep"):
+            path.unlink(missing_ok=True)
+
+    def cached(self, func):
+        """Decorator caching the shape returned by func, keyed by its arguments"""
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = self.key(func, bound.arguments)
+            shape = self.get(key)
+            if shape is None:
+                self.misses += 1
+                shape = func(*args, **kwargs)
+                self.put(key, shape)
+            else:
+                self.hits += 1
+            # Parts built from the same key are identical, which lets exporters treat
+            # them as instances of each other.
+            shape.cache_key = key
+            return shape
+
+        return wrapper
+
+
+# The cache shared by all the models
+part_cache = PartCache()
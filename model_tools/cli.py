@@ -0,0 +1,226 @@
+"""
+The command line entry point shared by all the model scripts.
+
+A model is a module providing:
+
+- ``build(**params)``: build the model and return a dict of its parts, keyed by label.
+  The defaults of its keyword arguments are the model's parameters.
+- ``export(parts, output_dir)``: write the files for printing, returning their paths.
+  Models that can write more than one file format also take ``formats``.
+- ``show_parts(parts)`` (optional): display the parts in the OCP CAD viewer. This is
+  the only place the viewer should be imported, so headless runs never load it.
+
+Run any model with ``--help`` to see the options, e.g.::
+
+    python ball_in_a_box.py --headless --output-dir build --set box_size=30
+"""
+
+import argparse
+import ast
+import copy
+import importlib
+import inspect
+import os
+import sys
+from pathlib import Path
+
+from model_tools import memory, trace
+from model_tools.mesh import QUALITY_PROFILES, report_tessellation, set_quality
+from model_tools.trace import report, stage
+from model_tools.validate import VALIDATION_MODES, set_validation, validation
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+
+def load_model(spec):
+    """Import a model given its module name or the path to its script
+
+    e.g. "ball_in_a_box", "terraforming_mars.player_mat" or
+    "coffee_filter_holder/coffee_filter_holder.py".
+    """
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    if spec.endswith(".py"):
+        path = Path(spec).resolve()
+        spec = ".".join(path.relative_to(REPO_ROOT).with_suffix("").parts)
+    return importlib.import_module(spec)
+
+
+def model_params(model):
+    """Return the default parameters of a model, taken from its build() signature"""
+    return {
+        name: copy.deepcopy(param.default)
+        for name, param in inspect.signature(model.build).parameters.items()
+        if param.default is not inspect.Parameter.empty
+    }
+
+
+def parse_value(text):
+    """Parse an override value as a Python literal, falling back to a plain string"""
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def apply_overrides(params, overrides):
+    """Apply "key=value" overrides to params, where key may be dotted into a dict
+
+    e.g. "body_vars.height=4" sets params["body_vars"]["height"] to 4.
+    """
+    params = copy.deepcopy(params)
+    for override in overrides:
+        key, sep, value = override.partition("=")
+        if not sep:
+            raise ValueError(f"Override {override!r} is not of the form key=value")
+        *path, name = key.strip().split(".")
+        target = params
+        for part in path:
+            if not isinstance(target.get(part), dict):
+                raise KeyError(f"Unknown parameter {key!r}")
+            target = target[part]
+        if name not in target:
+            raise KeyError(f"Unknown parameter {key!r}")
+        target[name] = parse_value(value.strip())
+    return params
+
+
+def make_parser(model):
+    description = (inspect.getdoc(model) or "").strip()
+    parser = argparse.ArgumentParser(
+        prog=Path(model.__file__).name,
+        description=description,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        default=os.environ.get("MODEL_HEADLESS", "") not in ("", "0"),
+        help="don't import or use the viewer (also set by MODEL_HEADLESS=1)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=Path,
+        default=Path("."),
+        help="directory to write the exported files to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-s",
+        "--set",
+        dest="overrides",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a parameter; keys may be dotted into dict parameters",
+    )
+    parser.add_argument(
+        "--no-export", action="store_true", help="build the model but don't export it"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        dest="formats",
+        action="append",
+        choices=["stl", "3mf"],
+        help="file format(s) to export, if the model supports choosing",
+    )
+    parser.add_argument(
+        "-q",
+        "--quality",
+        choices=list(QUALITY_PROFILES),
+        default=os.environ.get("MODEL_QUALITY"),
+        help="tessellation quality profile (default: the build123d Mesher defaults)",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="only spend triangles where the faces curve (implies -q print if unset)",
+    )
+    parser.add_argument(
+        "--validate",
+        choices=VALIDATION_MODES,
+        default=validation["mode"],
+        help="check the meshes are closed and manifold before writing them, and warn "
+        "or fail if they aren't (default: %(default)s, or set by MODEL_VALIDATE)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="don't use the cache of built parts"
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        metavar="FILE",
+        help="save the stage timings as a Chrome trace (see https://ui.perfetto.dev)",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        default=memory.enabled,
+        help="profile the memory used by each stage and shape, saving it as JSON next "
+        "to the exported files (also set by MODEL_MEMORY=on)",
+    )
+    parser.add_argument(
+        "--list-params",
+        action="store_true",
+        help="print the model's parameters and exit",
+    )
+    return parser
+
+
+def main(model, argv=None):
+    parser = make_parser(model)
+    args = parser.parse_args(argv)
+
+    params = model_params(model)
+    if args.list_params:
+        for name, value in params.items():
+            print(f"{name} = {value!r}")
+        return
+
+    try:
+        params = apply_overrides(params, args.overrides)
+    except (KeyError, ValueError) as exc:
+        parser.error(exc.args[0])
+
+    export_kwargs = {}
+    if args.formats:
+        if "formats" not in inspect.signature(model.export).parameters:
+            parser.error("this model can't choose its export formats")
+        export_kwargs["formats"] = args.formats
+
+    if args.no_cache:
+        from model_tools.cache import part_cache
+
+        part_cache.enabled = False
+
+    if args.trace:
+        trace.enabled = True
+    memory.enabled = args.memory
+
+    with stage("build"):
+        parts = model.build(**params)
+
+    if not args.headless and hasattr(model, "show_parts"):
+        with stage("show"):
+            model.show_parts(parts)
+
+    set_quality(args.quality, args.adaptive)
+    set_validation(args.validate)
+
+    if not args.no_export:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        with stage("export"):
+            paths = model.export(parts, args.output_dir, **export_kwargs)
+        for path in paths:
+            print(f"Wrote {path}")
+
+    report()
+    report_tessellation()
+    if args.trace:
+        print(f"Wrote {trace.write_chrome_trace(args.trace)}")
+    if args.memory:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        name = Path(model.__file__).stem
+        path = memory.write_json(args.output_dir / f"{name}.memory.json", name)
+        print(f"Wrote {path}")
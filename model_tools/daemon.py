@@ -0,0 +1,339 @@
+"""
+Keep build123d loaded in a background process, and build models through it.
+
+Importing build123d and starting up OCC takes a couple of seconds, which is most of the
+time a small model like the ball in a box takes to run. The daemon pays for that once,
+then builds and exports models sent to it over a Unix socket, taking the same options as
+the model scripts::
+
+    python -m model_tools.daemon serve &
+    python -m model_tools.daemon build ball_in_a_box --set box_size=30 -o build
+    python -m model_tools.daemon build coffee_filter_holder/coffee_filter_holder.py --watch
+    python -m model_tools.daemon stop
+
+``build`` prints the exported files and the stage timings of the build, just like
+running the script. With ``--watch`` it builds again every time the model, an SVG or JSON
+file next to it, or any other module the daemon has loaded from this repository is saved.
+
+Models run headless, one at a time, in the daemon. Repository modules whose files
+changed are imported again before the next build, and anything else the models keep
+between builds (such as the results of their stages) is kept too. Restart the daemon
+after changing model_tools itself.
+"""
+
+import argparse
+import contextlib
+import importlib
+import importlib.util
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+from model_tools import memory, trace
+from model_tools.cli import REPO_ROOT, apply_overrides, load_model, model_params
+from model_tools.mesh import QUALITY_PROFILES, set_quality, tessellation_stats
+from model_tools.validate import VALIDATION_MODES, set_validation
+
+REPO_PREFIX = str(REPO_ROOT) + os.sep
+TOOLS_PREFIX = str(Path(__file__).resolve().parent) + os.sep
+# The files the models are watched for changes in, besides their modules
+WATCHED_SUFFIXES = (".py", ".svg", ".json")
+# How often --watch looks for saved files, in seconds
+WATCH_INTERVAL = 0.5
+
+
+def default_socket_path():
+    if "MODEL_DAEMON_SOCKET" in os.environ:
+        return Path(os.environ["MODEL_DAEMON_SOCKET"])
+    return Path(tempfile.gettempdir()) / f"model_tools-{os.getuid()}.sock"
+
+
+def repo_modules():
+    """{name: path} of the modules imported from this repository, besides model_tools"""
+    modules = {}
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None) or ""
+        # Plain string checks, as there are thousands of modules loaded
+        if path.startswith(REPO_PREFIX) and not path.startswith(TOOLS_PREFIX):
+            modules[name] = Path(path)
+    return modules
+
+
+class ModelServer(socketserver.UnixStreamServer):
+    """Runs each job it's sent, one at a time, with build123d already loaded"""
+
+    def __init__(self, path):
+        self.mtimes = {}
+        self.builds = 0
+        self.stopping = False
+        super().__init__(str(path), JobHandler)
+
+    def forget_changed_modules(self):
+        """Drop the repository modules from sys.modules if any of them were saved, so
+        the next build imports them again (and the models see each other's changes)"""
+        modules = repo_modules()
+        changed = [
+            name
+            for name, path in modules.items()
+            if not path.exists() or path.stat().st_mtime != self.mtimes.get(name)
+        ]
+        if changed:
+            for name in modules:
+                del sys.modules[name]
+            importlib.invalidate_caches()
+        return changed
+
+    def run_job(self, job):
+        """Build and export a model, returning its paths, timings and output"""
+        if job.get("command") == "stop":
+            self.stopping = True
+            return {"stopped": True, "builds": self.builds}
+        if job.get("command") == "ping":
+            return {"pid": os.getpid(), "builds": self.builds}
+
+        reloaded = self.forget_changed_modules()
+        trace.reset()
+        trace.enabled = True
+        memory.reset()
+        memory.enabled = job.get("memory", False)
+        del tessellation_stats[:]
+        output = io.StringIO()
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                paths = build_model(job)
+            error = None
+        except Exception:
+            paths, error = [], traceback.format_exc()
+        finally:
+            memory.stop()
+            # Remember the modules as they are now, including any the build imported
+            self.mtimes = {
+                name: path.stat().st_mtime
+                for name, path in repo_modules().items()
+                if path.exists()
+            }
+        self.builds += 1
+        return {
+            "paths": [str(path) for path in paths],
+            "seconds": time.perf_counter() - start,
+            "timings": [timing._asdict() for timing in trace.timings],
+            "tessellation": list(tessellation_stats),
+            "output": output.getvalue(),
+            "reloaded": reloaded,
+            "watch": watched_files(job["model"]),
+            "error": error,
+        }
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        job = json.loads(self.rfile.readline())
+        try:
+            result = self.server.run_job(job)
+        except Exception:
+            result = {"error": traceback.format_exc()}
+        self.wfile.write(json.dumps(result).encode() + b"\n")
+
+
+def build_model(job):
+    """Build and export the model described by a job, the way cli.main() does"""
+    from model_tools.cache import part_cache
+
+    model = load_model(job["model"])
+    params = apply_overrides(model_params(model), job.get("overrides", []))
+    part_cache.enabled = not job.get("no_cache", False)
+    set_quality(job.get("quality"), job.get("adaptive", False))
+    set_validation(job.get("validate"))
+    with trace.stage("build"):
+        parts = model.build(**params)
+    output_dir = Path(job.get("output_dir", "."))
+    paths = []
+    if not job.get("no_export"):
+        output_dir.mkdir(parents=True, exist_ok=True)
+        export_kwargs = {"formats": job["formats"]} if job.get("formats") else {}
+        with trace.stage("export"):
+            paths = model.export(parts, output_dir, **export_kwargs)
+    if job.get("memory"):
+        output_dir.mkdir(parents=True, exist_ok=True)
+        name = Path(model.__file__).stem
+        paths.append(memory.write_json(output_dir / f"{name}.memory.json", name))
+    return paths
+
+
+def watched_files(model_spec):
+    """The files whose changes should rebuild a model: the repository modules loaded
+    in the daemon, and the sources and assets next to the model script"""
+    files = set(repo_modules().values())
+    if model_spec.endswith(".py"):
+        script = Path(model_spec).resolve()
+    else:
+        # Found without importing the model, as that may be what's failing
+        try:
+            script = Path(importlib.util.find_spec(model_spec).origin)
+        except (ImportError, AttributeError, ValueError):
+            return sorted(str(path) for path in files)
+    files.update(
+        path for path in script.parent.iterdir() if path.suffix in WATCHED_SUFFIXES
+    )
+    return sorted(str(path) for path in files)
+
+
+def warm_up():
+    """Import build123d and have OCC build, cut and tessellate something once"""
+    with trace.stage("warm up"):
+        from build123d import Box, Sphere
+
+        from model_tools.mesh import tessellate
+
+        tessellate(Box(10, 10, 10) - Sphere(6))
+
+
+def serve(path):
+    path = Path(path)
+    if path.exists():
+        with contextlib.suppress(OSError):
+            send({"command": "ping"}, path)
+            raise SystemExit(f"A daemon is already listening on {path}")
+        path.unlink()
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    warm_up()
+    print(
+        f"Listening on {path} (warmed up in {trace.timings[-1].seconds:.1f}s)",
+        file=sys.stderr,
+    )
+    try:
+        with ModelServer(path) as server:
+            while not server.stopping:
+                server.handle_request()
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+
+
+def send(job, path):
+    """Send a job to the daemon, returning its result"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(path))
+        client.sendall(json.dumps(job).encode() + b"\n")
+        with client.makefile("rb") as response:
+            return json.loads(response.readline())
+
+
+def print_result(result, file=None):
+    """Print a build result like the model scripts would, returning an exit status"""
+    file = file or sys.stderr
+    if result.get("output"):
+        print(result["output"], end="", file=file)
+    if result.get("reloaded"):
+        print(f"Reloaded {', '.join(result['reloaded'])}", file=file)
+    if result.get("error"):
+        print(result["error"], end="", file=file)
+        return 1
+    for path in result["paths"]:
+        print(f"Wrote {path}")
+    # Show the daemon's timings with the same reports as a normal run
+    trace.timings[:] = [trace.Timing(**timing) for timing in result["timings"]]
+    tessellation_stats[:] = [tuple(stats) for stats in result["tessellation"]]
+    trace.report(file)
+    from model_tools.mesh import report_tessellation
+
+    report_tessellation(file)
+    print(f"Built in {result['seconds']:.3f}s", file=file)
+    return 0
+
+
+def mtimes(files):
+    return {path: os.stat(path).st_mtime for path in files if os.path.exists(path)}
+
+
+def build(job, path, watch=False):
+    result = send(job, path)
+    status = print_result(result)
+    while watch:
+        files = result.get("watch") or []
+        print(f"Watching {len(files)} files for changes...", file=sys.stderr)
+        seen = mtimes(files)
+        while mtimes(files) == seen:
+            time.sleep(WATCH_INTERVAL)
+        result = send(job, path)
+        status = print_result(result)
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m model_tools.daemon",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        default=default_socket_path(),
+        help="the daemon's socket (default: $MODEL_DAEMON_SOCKET or %(default)s)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("serve", help="start the daemon, in the foreground")
+    commands.add_parser("stop", help="stop the daemon")
+    build_parser = commands.add_parser("build", help="build and export a model")
+    build_parser.add_argument("model", help="module name or path of the model script")
+    build_parser.add_argument("-o", "--output-dir", type=Path, default=Path("."))
+    build_parser.add_argument(
+        "-s", "--set", dest="overrides", action="append", default=[], metavar="K=V"
+    )
+    build_parser.add_argument("--no-export", action="store_true")
+    build_parser.add_argument(
+        "-f", "--format", dest="formats", action="append", choices=["stl", "3mf"]
+    )
+    build_parser.add_argument("-q", "--quality", choices=list(QUALITY_PROFILES))
+    build_parser.add_argument("--adaptive", action="store_true")
+    build_parser.add_argument("--validate", choices=VALIDATION_MODES)
+    build_parser.add_argument("--no-cache", action="store_true")
+    build_parser.add_argument(
+        "--memory", action="store_true", help="profile its memory use, saved as JSON"
+    )
+    build_parser.add_argument(
+        "-w", "--watch", action="store_true", help="build again whenever it's saved"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        return serve(args.socket)
+    try:
+        if args.command == "stop":
+            result = send({"command": "stop"}, args.socket)
+            print(f"Stopped after {result['builds']} builds", file=sys.stderr)
+            return 0
+        job = {
+            "model": args.model,
+            "overrides": args.overrides,
+            # The daemon may well have been started from elsewhere
+            "output_dir": str(args.output_dir.resolve()),
+            "no_export": args.no_export,
+            "formats": args.formats,
+            "quality": args.quality,
+            "adaptive": args.adaptive,
+            "validate": args.validate,
+            "no_cache": args.no_cache,
+            "memory": args.memory,
+        }
+        if args.model.endswith(".py"):
+            job["model"] = str(Path(args.model).resolve())
+        return build(job, args.socket, args.watch)
+    except (FileNotFoundError, ConnectionRefusedError):
+        parser.exit(1, f"No daemon listening on {args.socket}, start one with serve\n")
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""
+Measure how far apart two meshes are, e.g. a model and the reference it was based on.
+
+Points are sampled evenly over the surface of each mesh, and the distance from each of
+them to the nearest point sampled from the other mesh is found with a grid hash: the
+points are bucketed into cubic cells, so only the points in the neighbouring cells need
+to be looked at. Points with nothing in their neighbourhood are looked for again among
+voxels of the points (see far_distances), so points far from the other mesh don't have
+to be measured against everything within reach of them.
+
+From those distances come the one-sided deviations (from the mesh to the reference, and
+back), their maximum being the Hausdorff distance, and the means. The distances are only
+as accurate as the spacing of the samples, which is reported alongside them. ::
+
+    python -m model_tools.deviation part.stl reference.stl --regions 4x2
+"""
+
+import argparse
+import json
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from model_tools.mesh import read_stl
+
+# How many candidate (query, point) pairs are measured at a time
+PAIRS_PER_CHUNK = 1 << 20
+
+# The largest and mean distance from the points of one mesh to the other
+Deviation = namedtuple("Deviation", "max mean")
+
+
+def surface_area(mesh):
+    corners = mesh.vertices[mesh.triangles]
+    cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    return np.linalg.norm(cross, axis=1) / 2
+
+
+def sample_points(mesh, count, seed=0):
+    """count points spread uniformly at random over the surface of the mesh"""
+    rng = np.random.default_rng(seed)
+    areas = surface_area(mesh)
+    chosen = rng.choice(len(areas), size=count, p=areas / areas.sum())
+    # Uniform over each triangle, by folding the points outside of it back in
+    u, v = rng.random((2, count))
+    outside = u + v > 1
+    u[outside], v[outside] = 1 - u[outside], 1 - v[outside]
+    corners = mesh.vertices[mesh.triangles[chosen]]
+    return (
+        corners[:, 0]
+        + u[:, None] * (corners[:, 1] - corners[:, 0])
+        + v[:, None] * (corners[:, 2] - corners[:, 0])
+    )
+
+
+class GridIndex:
+    """Points bucketed into cubic cells, for finding the nearest of them to others"""
+
+    def __init__(self, points, cell_size):
+        self.points = points
+        self.cell_size = cell_size
+        self.origin = points.min(axis=0)
+        cells = self.cells(points)
+        self.shape = cells.max(axis=0) + 1
+        keys = self.keys(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.cell_keys, self.starts, self.counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True
+        )
+
+    def cells(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def keys(self, cells):
+        return (cells[:, 0] * self.shape[1] + cells[:, 1]) * self.shape[2] + cells[:, 2]
+
+    def members(self, owners, cells):
+        """Pair each owner with every point in its cell (an index into cell_keys),
+        yielding the (owners, points) index arrays a chunk at a time"""
+        counts = self.counts[cells]
+        bounds = np.searchsorted(
+            np.cumsum(counts), np.arange(PAIRS_PER_CHUNK, counts.sum(), PAIRS_PER_CHUNK)
+        )
+        for chunk in np.split(np.arange(len(cells)), bounds):
+            repeated = np.repeat(chunk, counts[chunk])
+            # The position of each pair within its cell: 0, 1, ... count - 1
+            first = np.cumsum(counts[chunk]) - counts[chunk]
+            within = np.arange(len(repeated)) - np.repeat(first, counts[chunk])
+            yield owners[repeated], self.order[self.starts[cells[repeated]] + within]
+
+    def neighbours(self, queries):
+        """Pair each query with every point in the 27 cells around it, yielding the
+        (queries, points) index arrays a chunk at a time"""
+        cells = self.cells(queries)
+        for offset in np.ndindex(3, 3, 3):
+            neighbours = cells + np.array(offset) - 1
+            inside = np.all((neighbours >= 0) & (neighbours < self.shape), axis=1)
+            queried = np.flatnonzero(inside)
+            keys = self.keys(neighbours[queried])
+            found = np.searchsorted(self.cell_keys, keys)
+            found[found == len(self.cell_keys)] = 0
+            hit = self.cell_keys[found] == keys
+            yield from self.members(queried[hit], found[hit])
+
+    def nearest(self, queries):
+        """The distance from each query to the nearest point, and whether that's
+        certain: points further away than a cell could be nearer than the ones found"""
+        best = np.full(len(queries), np.inf)
+        for queried, points in self.neighbours(queries):
+            np.minimum.at(
+                best, queried, squared_distances(queries[queried], self.points[points])
+            )
+        distances = np.sqrt(best)
+        return distances, distances <= self.cell_size
+
+
+def squared_distances(a, b):
+    difference = a - b
+    return np.einsum("ij,ij->i", difference, difference)
+
+
+def nearest_distances(queries, points, cell_size):
+    """The distance from each of the queries to the nearest of the points"""
+    distances, certain = GridIndex(points, cell_size).nearest(queries)
+    far = np.flatnonzero(~certain)
+    if len(far):
+        distances[far] = far_distances(queries[far], points, cell_size * 4)
+    return distances
+
+
+def far_distances(queries, points, voxel_size):
+    """The distance from each of the queries to the nearest of the points, for queries
+    that are far from all of them
+
+    Looking through all the points within reach of far away queries gets expensive, so
+    the points are grouped into voxels, one point from each standing in for the rest.
+    The nearest of those is as far as the nearest point can be, and only the points in
+    the voxels that could hold a point nearer than that need to be measured.
+    """
+    if len(points) == 1:
+        return np.sqrt(squared_distances(queries, points))
+    voxels = GridIndex(points, voxel_size)
+    if len(voxels.cell_keys) == len(points):
+        # A point per voxel already, so there's nothing to gain from them
+        return far_distances(queries, points, voxel_size * 2)
+
+    stand_ins = points[voxels.order[voxels.starts]]
+    upper = nearest_distances(queries, stand_ins, voxel_size)
+    best = upper**2
+    # A voxel may hold a nearer point if its center is within reach of the query
+    centers = voxels.origin + (voxels.cells(stand_ins) + 0.5) * voxel_size
+    reach = upper + voxel_size * np.sqrt(3) / 2
+    pending = np.arange(len(queries))
+    cell_size = voxel_size
+    while len(pending):
+        within = reach[pending] <= cell_size
+        batch, pending = pending[within], pending[~within]
+        if len(batch):
+            for queried, near in GridIndex(centers, cell_size).neighbours(
+                queries[batch]
+            ):
+                queried = batch[queried]
+                close = squared_distances(queries[queried], centers[near])
+                close = close <= reach[queried] ** 2
+                for owners, nearer in voxels.members(queried[close], near[close]):
+                    np.minimum.at(
+                        best,
+                        owners,
+                        squared_distances(queries[owners], points[nearer]),
+                    )
+        cell_size *= 2
+    return np.sqrt(best)
+
+
+def compare(mesh, reference, samples=100_000, seed=0):
+    """Sample both meshes and measure the distances between them
+
+    Returns a dict with the sample spacing, the Deviation of the mesh from the reference
+    ("forward") and of the reference from the mesh ("backward"), the symmetric Hausdorff
+    distance and mean deviation, and the points and distances of both directions for
+    regions().
+    """
+    points = sample_points(mesh, samples, seed)
+    reference_points = sample_points(reference, samples, seed + 1)
+    area = max(surface_area(mesh).sum(), surface_area(reference).sum())
+    spacing = np.sqrt(area / samples)
+    # Cells a few samples wide, so there are only a handful of points in each
+    forward = nearest_distances(points, reference_points, 2 * spacing)
+    backward = nearest_distances(reference_points, points, 2 * spacing)
+    both = np.concatenate([forward, backward])
+    return {
+        "spacing": spacing,
+        "forward": Deviation(forward.max(), forward.mean()),
+        "backward": Deviation(backward.max(), backward.mean()),
+        "hausdorff": both.max(),
+        "mean": both.mean(),
+        "points": np.concatenate([points, reference_points]),
+        "distances": both,
+    }
+
+
+def regions(points, distances, divisions=(4, 2)):
+    """Split the XY extent of the points into a grid of regions, returning the
+    ((x min, y min), (x max, y max)) bounds and Deviation of the points in each"""
+    low, high = points[:, :2].min(axis=0), points[:, :2].max(axis=0)
+    divisions = np.array(divisions)
+    size = (high - low) / divisions
+    cells = np.minimum(((points[:, :2] - low) / size).astype(int), divisions - 1)
+    labels = cells[:, 0] * divisions[1] + cells[:, 1]
+    count = np.bincount(labels, minlength=divisions.prod())
+    total = np.bincount(labels, distances, minlength=divisions.prod())
+    largest = np.zeros(divisions.prod())
+    np.maximum.at(largest, labels, distances)
+    results = []
+    for label, (i, j) in enumerate(np.ndindex(*divisions)):
+        if count[label]:
+            start = low + size * (i, j)
+            results.append(
+                (
+                    (tuple(start), tuple(start + size)),
+                    Deviation(largest[label], total[label] / count[label]),
+                )
+            )
+    return results
+
+
+def summary(result, divisions=None):
+    """A JSON friendly summary of a compare() result"""
+
+    def rounded(value):
+        return round(float(value), 4)
+
+    data = {
+        "spacing": rounded(result["spacing"]),
+        "forward": {k: rounded(v) for k, v in result["forward"]._asdict().items()},
+        "backward": {k: rounded(v) for k, v in result["backward"]._asdict().items()},
+        "hausdorff": rounded(result["hausdorff"]),
+        "mean": rounded(result["mean"]),
+    }
+    if divisions:
+        data["regions"] = [
+            {
+                "min": [rounded(v) for v in low],
+                "max": [rounded(v) for v in high],
+                "max_deviation": rounded(deviation.max),
+                "mean_deviation": rounded(deviation.mean),
+            }
+            for (low, high), deviation in regions(
+                result["points"], result["distances"], divisions
+            )
+        ]
+    return data
+
+
+def report(name, result, divisions=None, file=None):
+    """Print the deviations of a compare() result, and per region if divisions given"""
+    file = file or sys.stdout
+    print(
+        f"{name}: Hausdorff {result['hausdorff']:.3f}mm, mean {result['mean']:.3f}mm "
+        f"(forward max {result['forward'].max:.3f}mm, mean {result['forward'].mean:.3f}mm"
+        f"; backward max {result['backward'].max:.3f}mm, "
+        f"mean {result['backward'].mean:.3f}mm; samples {result['spacing']:.2f}mm apart)",
+        file=file,
+    )
+    if not divisions:
+        return
+    for (low, high), deviation in regions(
+        result["points"], result["distances"], divisions
+    ):
+        area = f"x {low[0]:7.1f} to {high[0]:7.1f}, y {low[1]:7.1f} to {high[1]:7.1f}"
+        print(
+            f"  {area}  max {deviation.max:7.3f}mm  mean {deviation.mean:7.3f}mm",
+            file=file,
+        )
+
+
+def parse_divisions(text):
+    """Turn "4x2" into (4, 2)"""
+    try:
+        x, y = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text!r} is not of the form NxM") from None
+    return x, y
+
+
+def check(results, max_hausdorff=None, max_mean=None, file=None):
+    """Print which results exceed the limits, returning whether they all passed"""
+    passed = True
+    for name, result in results.items():
+        for measure, limit in [("hausdorff", max_hausdorff), ("mean", max_mean)]:
+            if limit is not None and result[measure] > limit:
+                print(
+                    f"{name}: {measure} deviation {result[measure]:.3f}mm is over the "
+                    f"limit of {limit}mm",
+                    file=file or sys.stderr,
+                )
+                passed = False
+    return passed
+
+
+def add_arguments(parser):
+    """The options shared by the command lines comparing meshes"""
+    parser.add_argument(
+        "-n",
+        "--samples",
+        type=int,
+        default=100_000,
+        help="points sampled from each mesh (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--regions",
+        type=parse_divisions,
+        metavar="NxM",
+        help="also report the deviations in an N by M grid of regions",
+    )
+    parser.add_argument("--max-hausdorff", type=float, metavar="MM")
+    parser.add_argument("--max-mean", type=float, metavar="MM")
+    parser.add_argument("--json", type=argparse.FileType("w"), metavar="FILE")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m model_tools.deviation",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("mesh", help="the STL file to check")
+    parser.add_argument("reference", help="the STL file it should match")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    result = compare(read_stl(args.mesh), read_stl(args.reference), args.samples)
+    report(args.mesh, result, args.regions)
+    if args.json:
+        json.dump(summary(result, args.regions), args.json, indent=2)
+    return 0 if check({args.mesh: result}, args.max_hausdorff, args.max_mean) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Fuse a lot of shapes into one, a spatial chunk at a time, in parallel.
+
+Fusing thousands of faces in one go (``Sketch() + faces``) is a single boolean running on
+a single core. Here the shapes are instead split into chunks of neighbouring shapes,
+each chunk is fused in a worker process, and the results are fused in pairs, level by
+level, until there is only one left::
+
+    sketch = tree_fuse(model.faces())
+
+The shapes are sent between the processes as BREP bytes. The result is the same union as
+fusing everything at once, although its faces and edges may come out in another order.
+"""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model_tools.mesh import shape_from_brep, shape_to_brep
+
+# The fewest shapes worth sending to a worker process to fuse. Fusing in a tree does
+# more work overall than fusing everything at once (about twice as much for a few hundred
+# mesh faces), so it only pays off for big sets of shapes spread over several cores.
+MIN_CHUNK = 256
+
+
+def spatial_chunks(shapes, size):
+    """Split the shapes into chunks of at most size shapes, with the shapes in each
+    chunk close together, by halving them across the longest side of their centers"""
+    centers = np.array([tuple(shape.center()) for shape in shapes]).reshape(-1, 3)
+    chunks = []
+    pending = [np.arange(len(shapes))]
+    while pending:
+        indices = pending.pop()
+        if len(indices) <= size:
+            chunks.append([shapes[i] for i in indices])
+            continue
+        points = centers[indices]
+        axis = np.argmax(points.max(axis=0) - points.min(axis=0))
+        order = indices[np.argsort(points[:, axis], kind="stable")]
+        half = len(order) // 2
+        pending += [order[half:], order[:half]]
+    return chunks
+
+
+def fuse_shapes(shapes):
+    """Fuse the shapes, and the shapes in any compounds among them, in one boolean"""
+    summands = [top for shape in shapes for top in shape.get_top_level_shapes()]
+    if not summands:
+        raise ValueError("There are no shapes to fuse")
+    first, *rest = summands
+    return first.fuse(*rest) if rest else first
+
+
+def fuse_breps(payloads):
+    """Worker function: fuse the shapes sent over as BREP bytes"""
+    return shape_to_brep(fuse_shapes([shape_from_brep(data) for data in payloads]))
+
+
+def pairs(items):
+    """[a, b, c, d, e] -> [[a, b], [c, d], [e]]"""
+    return [items[i : i + 2] for i in range(0, len(items), 2)]
+
+
+def tree_fuse(shapes, processes=None, chunk_size=None):
+    """Fuse the shapes into one, fusing spatial chunks of them in parallel and then
+    the results in pairs until there's only one
+
+    Raises a ValueError if there are no shapes to fuse.
+
+    Args:
+        shapes: the shapes to fuse
+        processes: the number of worker processes, defaulting to one per CPU. With a
+            single one, everything is fused in this process, all at once.
+        chunk_size: how many shapes to fuse in each chunk, by default enough to give
+            each worker two chunks
+    """
+    shapes = list(shapes)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(shapes) < 2 * MIN_CHUNK:
+        return fuse_shapes(shapes)
+    if chunk_size is None:
+        chunk_size = max(MIN_CHUNK, math.ceil(len(shapes) / (2 * processes)))
+
+    from build123d import Compound
+
+    payloads = [
+        shape_to_brep(Compound(chunk)) for chunk in spatial_chunks(shapes, chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(fuse_breps, [[data] for data in payloads]))
+        # The chunks come out of spatial_chunks() in order, so each result is fused
+        # with its neighbour's
+        while len(results) > 1:
+            results = list(pool.map(fuse_breps, pairs(results)))
+    return shape_from_brep(results[0])
@@ -0,0 +1,55 @@
+"""
+Find the parts that are just relocated copies of each other.
+
+Two parts are instances of the same geometry when they share the underlying TShape (as
+made by ``copy.copy`` followed by ``locate``), or when they were built by the part cache
+from the same parameters (they carry the same ``cache_key``). Such parts only need to be
+tessellated once, in their own frame, and then placed with their location's transform.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# prototype: the shared geometry, unlocated. instances: the parts using it.
+InstanceGroup = namedtuple("InstanceGroup", "prototype instances")
+
+
+def unlocated(shape):
+    """Return shape with its location stripped, i.e. in the frame of its TShape"""
+    from build123d import Compound
+    from OCP.TopLoc import TopLoc_Location
+
+    prototype = Compound.cast(shape.wrapped.Located(TopLoc_Location()))
+    prototype.label = shape.label
+    return prototype
+
+
+def location_matrix(shape):
+    """The 4x4 transform placing the TShape of shape where the shape is"""
+    trsf = shape.wrapped.Location().Transformation()
+    matrix = np.eye(4)
+    for row in range(3):
+        for col in range(4):
+            matrix[row, col] = trsf.Value(row + 1, col + 1)
+    return matrix
+
+
+def same_geometry(a, b):
+    key = getattr(a, "cache_key", None)
+    if key is not None and key == getattr(b, "cache_key", None):
+        return True
+    return a.wrapped.IsPartner(b.wrapped)
+
+
+def group_instances(shapes):
+    """Group shapes sharing the same geometry, keeping the order they first appear"""
+    groups = []
+    for shape in shapes:
+        for group in groups:
+            if same_geometry(group.instances[0], shape):
+                group.instances.append(shape)
+                break
+        else:
+            groups.append(InstanceGroup(unlocated(shape), [shape]))
+    return groups
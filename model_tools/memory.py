@@ -0,0 +1,205 @@
+"""
+Opt-in memory profiling of the stages of a build, and of the shapes it makes.
+
+With profiling on (``--memory`` on the command line, or ``MODEL_MEMORY=on``), every
+``trace.stage`` also records the resident set size of the process before and after it,
+and what tracemalloc saw Python allocate: before, after, the peak during the stage, and
+the lines that allocated the most. tracemalloc can't see what OCC allocates, only the
+RSS can, so the growth of the RSS that tracemalloc doesn't account for is roughly what
+went on shape trees, triangulations and the like.
+
+Every shape tessellated by model_tools.mesh, and any other passed to ``record_shape``, is
+recorded too: its face, edge and vertex counts, its triangle count, and estimates of its
+size in bytes. ``write_json`` saves it all, e.g. next to the exported files::
+
+    python terraforming_mars/player_mat.py --headless --memory -o build
+
+Profiling slows the Python parts of a build down a lot, so the timings of a profiled
+build are best not compared with anything else.
+"""
+
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+enabled = os.environ.get("MODEL_MEMORY", "").lower() in ("on", "1", "true", "yes")
+
+# How many of the lines allocating the most during a stage to record
+TOP_ALLOCATIONS = 10
+
+# Sizes are in bytes. rss_*: the resident set size before and after the stage. traced_*:
+# the memory tracemalloc saw allocated before, after and at most during the stage.
+# untraced_growth: how much more the RSS grew than what tracemalloc saw (or its own
+# overhead) accounts for. top_allocations: the lines that allocated the most during it.
+StageMemory = namedtuple(
+    "StageMemory",
+    "name path depth start rss_before rss_after traced_before traced_after traced_peak "
+    "untraced_growth top_allocations pid",
+)
+
+# A StageMemory for every finished stage
+stages = []
+# A dict of statistics for every recorded shape
+shapes = []
+# Those of the stages currently running
+_running = []
+
+
+class _Running:
+    def __init__(self, stage):
+        self.stage = stage
+        self.start = time.perf_counter()
+        # Taken first, so the snapshot is in the before and after figures alike
+        self.allocations = allocations_by_line()
+        self.rss = current_rss()
+        self.traced = tracemalloc.get_traced_memory()[0]
+        self.overhead = tracemalloc.get_tracemalloc_memory()
+        # The highest peak of the stages run inside this one so far
+        self.peak = 0
+
+
+def current_rss():
+    """The resident set size of this process now in bytes, or 0 if unknown"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def allocations_by_line():
+    """{"file:line": (bytes, blocks)} of the memory tracemalloc is tracing, besides
+    what it and this module allocated to keep track of it"""
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+    )
+    return {
+        str(stat.traceback[0]): (stat.size, stat.count)
+        for stat in snapshot.statistics("lineno")
+    }
+
+
+def reset():
+    stages.clear()
+    shapes.clear()
+
+
+def stop():
+    """Turn profiling off, and stop tracemalloc slowing everything down"""
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def stage_started(stage):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if _running:
+        # Peaks are reset for each stage, so keep the enclosing stage's so far
+        _running[-1].peak = max(_running[-1].peak, tracemalloc.get_traced_memory()[1])
+    _running.append(_Running(stage))
+    tracemalloc.reset_peak()
+
+
+def stage_finished(stage):
+    # Check it's ours, in case profiling was turned on while the stage was running
+    if not _running or _running[-1].stage is not stage:
+        return
+    running = _running.pop()
+    traced, peak = tracemalloc.get_traced_memory()
+    peak = max(peak, running.peak)
+    allocations = allocations_by_line()
+    rss = current_rss()
+    overhead = tracemalloc.get_tracemalloc_memory()
+
+    growth = []
+    for line, (size, count) in allocations.items():
+        before_size, before_count = running.allocations.get(line, (0, 0))
+        if size > before_size:
+            growth.append((size - before_size, count - before_count, line))
+    growth.sort(reverse=True)
+    stages.append(
+        StageMemory(
+            stage.name,
+            "/".join([outer.stage.name for outer in _running] + [stage.name]),
+            len(_running),
+            running.start,
+            running.rss,
+            rss,
+            running.traced,
+            traced,
+            peak,
+            (rss - running.rss)
+            - (traced - running.traced)
+            - (overhead - running.overhead),
+            [
+                {"line": line, "bytes": size, "blocks": count}
+                for size, count, line in growth[:TOP_ALLOCATIONS]
+            ],
+            os.getpid(),
+        )
+    )
+    if _running:
+        _running[-1].peak = max(_running[-1].peak, peak)
+    tracemalloc.reset_peak()
+
+
+def brep_bytes(shape):
+    """The size of the shape written as BREP, without any triangulation, as a rough
+    measure of the size of its shape tree"""
+    from OCP.BRepTools import BRepTools
+    from OCP.TopTools import TopTools_FormatVersion_CURRENT
+
+    stream = io.BytesIO()
+    BRepTools.Write_s(
+        shape.wrapped, stream, False, False, TopTools_FormatVersion_CURRENT
+    )
+    return len(stream.getvalue())
+
+
+def record_shape(shape, mesh=None, label=None):
+    """Record the size of a shape, and of the mesh it was tessellated into if given"""
+    if not enabled:
+        return
+    stats = {
+        "label": label or shape.label or type(shape).__name__,
+        "stage": "/".join(running.stage.name for running in _running),
+        "faces": len(shape.faces()),
+        "edges": len(shape.edges()),
+        "vertices": len(shape.vertices()),
+        "brep_bytes": brep_bytes(shape),
+        "pid": os.getpid(),
+    }
+    if mesh is not None:
+        stats["triangles"] = len(mesh.triangles)
+        stats["mesh_bytes"] = mesh.vertices.nbytes + mesh.triangles.nbytes
+    shapes.append(stats)
+
+
+def as_dict(name=None):
+    return {
+        "name": name or os.path.basename(sys.argv[0]),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        # Stages are recorded as they finish, so a parent comes after its children
+        "stages": [
+            stage._asdict()
+            for stage in sorted(stages, key=lambda stage: (stage.pid, stage.start))
+        ],
+        "shapes": list(shapes),
+    }
+
+
+def write_json(path, name=None):
+    """Save the recorded stages and shapes as a JSON file"""
+    with open(path, "w", encoding="utf-8") as memory_file:
+        json.dump(as_dict(name), memory_file, indent=2)
+        memory_file.write("\n")
+    return path
@@ -0,0 +1,528 @@
+"""
+Tessellate shapes into NumPy triangle meshes and write them out as STL files.
+
+A ``Mesh`` is just a pair of arrays: ``vertices`` (n, 3) and ``triangles`` (m, 3) of
+indices into the vertices, in the same frame as the shape it came from. Meshes are cheap
+to pickle, so shapes can be tessellated in worker processes (they are shipped there as
+BREP bytes) and the results combined into files in the parent.
+
+How finely to tessellate is chosen with a named quality profile (see
+``QUALITY_PROFILES``), optionally in adaptive mode where the triangles are spent
+according to the curvature of the faces rather than a fixed angle. Without a profile the
+build123d Mesher defaults are used.
+"""
+
+import io
+import math
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from model_tools import memory
+
+Mesh = namedtuple("Mesh", "vertices triangles")
+
+# The binary STL record for a single triangle
+STL_DTYPE = np.dtype(
+    [
+        ("normal", "<f4", (3,)),
+        ("vertices", "<f4", (3, 3)),
+        ("attributes", "<u2"),
+    ]
+)
+
+# Match the Mesher defaults: deflection relative to the size of each edge
+DEFAULT_LINEAR_DEFLECTION = 0.001
+DEFAULT_ANGULAR_DEFLECTION = 0.1
+
+# Absolute chord error in mm and angle between segments in radians
+Quality = namedtuple("Quality", "linear_deflection angular_deflection")
+QUALITY_PROFILES = {
+    "draft": Quality(0.2, 0.8),
+    "preview": Quality(0.05, 0.4),
+    "print": Quality(0.01, 0.15),
+}
+# The coarsest angle adaptive mode will use, even for the tightest curves
+MAX_ADAPTIVE_ANGLE = math.pi / 3
+
+# How many triangles are turned into STL records at a time
+STL_CHUNK = 1 << 16
+
+# The quality used when none is passed in, set from the command line with set_quality()
+default_quality = {"quality": os.environ.get("MODEL_QUALITY"), "adaptive": False}
+
+# (label, triangle count, seconds) for every shape tessellated by tessellate_all()
+tessellation_stats = []
+
+
+def shape_to_brep(shape):
+    """Serialise a shape to BREP bytes"""
+    from build123d import export_brep
+
+    stream = io.BytesIO()
+    export_brep(shape, stream)
+    return stream.getvalue()
+
+
+def shape_from_brep(data):
+    """Read a shape back from BREP bytes"""
+    from build123d import Compound
+    from OCP.BRep import BRep_Builder
+    from OCP.BRepTools import BRepTools
+    from OCP.TopoDS import TopoDS_Shape
+
+    shape = TopoDS_Shape()
+    BRepTools.Read_s(shape, io.BytesIO(data), BRep_Builder())
+    if shape.IsNull():
+        raise ValueError("Could not read shape from BREP data")
+    return Compound.cast(shape)
+
+
+def set_quality(quality=None, adaptive=False):
+    """Set the quality profile used when tessellating without an explicit one"""
+    if quality is not None and quality not in QUALITY_PROFILES:
+        raise ValueError(f"Unknown quality profile {quality!r}")
+    default_quality.update(quality=quality, adaptive=adaptive)
+
+
+def face_min_radius(face, samples=5):
+    """The tightest radius of curvature of a face, or inf if it is flat"""
+    from OCP.BRepAdaptor import BRepAdaptor_Surface
+    from OCP.BRepLProp import BRepLProp_SLProps
+    from OCP.GeomAbs import (
+        GeomAbs_Cone,
+        GeomAbs_Cylinder,
+        GeomAbs_Plane,
+        GeomAbs_Sphere,
+        GeomAbs_Torus,
+    )
+
+    surface = BRepAdaptor_Surface(face.wrapped)
+    kind = surface.GetType()
+    if kind == GeomAbs_Plane:
+        return math.inf
+    if kind == GeomAbs_Cylinder:
+        return surface.Cylinder().Radius()
+    if kind == GeomAbs_Sphere:
+        return surface.Sphere().Radius()
+    if kind == GeomAbs_Torus:
+        return surface.Torus().MinorRadius()
+
+    # Cones and free form surfaces (Beziers, lofts, ...) have varying curvature, so
+    # sample it over the face
+    u0, u1 = surface.FirstUParameter(), surface.LastUParameter()
+    v0, v1 = surface.FirstVParameter(), surface.LastVParameter()
+    props = BRepLProp_SLProps(surface, 2, 1e-7)
+    curvature = 0.0
+    for u in np.linspace(u0, u1, samples):
+        for v in np.linspace(v0, v1, samples):
+            props.SetParameters(u, v)
+            if props.IsCurvatureDefined():
+                curvature = max(
+                    curvature, abs(props.MaxCurvature()), abs(props.MinCurvature())
+                )
+    if kind == GeomAbs_Cone and curvature == 0.0:
+        return math.inf  # only the apex, which we can't sample
+    return 1 / curvature if curvature > 1e-9 else math.inf
+
+
+def adaptive_angle(face, linear_deflection, angular_deflection):
+    """The angular deflection that lets the chord error control a face
+
+    For a curved face this is the angle a segment can span on its tightest curve without
+    deviating more than linear_deflection from it, so small fillets aren't forced into
+    the many segments a fixed angle would give them, while the chord error still keeps
+    the flatter curves accurate. Planar faces only need triangles for their boundaries,
+    so they get the coarsest angle.
+    """
+    radius = face_min_radius(face)
+    if radius == math.inf:
+        return MAX_ADAPTIVE_ANGLE
+    angle = 2 * math.acos(max(-1.0, 1 - linear_deflection / radius))
+    return min(max(angle, angular_deflection), MAX_ADAPTIVE_ANGLE)
+
+
+def mesh_faces_adaptively(shape, linear_deflection, angular_deflection):
+    """Mesh each face of the shape with its own angular deflection (see adaptive_angle)
+
+    The whole shape is meshed first with the coarsest angle, which is all the planar
+    faces need, and with its edges split at the finest angle. Then each curved face is
+    meshed again with its own angle. Meshing the faces one at a time from the start
+    splits some of the edges two faces share differently for each, leaving cracks, but
+    re-meshing a face keeps the edge points its neighbours already have.
+    """
+    from OCP.BRepMesh import BRepMesh_IncrementalMesh
+    from OCP.BRepTools import BRepTools
+    from OCP.IMeshTools import IMeshTools_Parameters
+
+    faces = shape.faces()
+    angles = [
+        adaptive_angle(face, linear_deflection, angular_deflection) for face in faces
+    ]
+    if not faces:
+        return
+
+    def mesh(target, interior_angle):
+        params = IMeshTools_Parameters()
+        params.Deflection = params.DeflectionInterior = linear_deflection
+        params.Angle = min(angles)
+        params.AngleInterior = interior_angle
+        params.Relative = False
+        # Keep the triangulations of the other faces
+        params.CleanModel = False
+        BRepMesh_IncrementalMesh(target, params)
+
+    mesh(shape.wrapped, max(angles))
+    for face, angle in zip(faces, angles):
+        if angle < max(angles):
+            BRepTools.Clean_s(face.wrapped)
+            mesh(face.wrapped, angle)
+
+
+def tessellation_settings(quality=None, adaptive=None):
+    """The tessellate() keyword arguments for a quality profile
+
+    With no profile given (and none set by set_quality) the Mesher defaults are used,
+    unless in adaptive mode, which needs the absolute tolerances of the print profile.
+    """
+    if quality is None:
+        quality = default_quality["quality"]
+    if adaptive is None:
+        adaptive = default_quality["adaptive"]
+    if quality is None and adaptive:
+        quality = "print"
+    if quality is None:
+        return {}
+    profile = QUALITY_PROFILES[quality]
+    return {
+        "linear_deflection": profile.linear_deflection,
+        "angular_deflection": profile.angular_deflection,
+        "relative": False,
+        "adaptive": adaptive,
+    }
+
+
+def tessellate(
+    shape,
+    linear_deflection=DEFAULT_LINEAR_DEFLECTION,
+    angular_deflection=DEFAULT_ANGULAR_DEFLECTION,
+    relative=True,
+    adaptive=False,
+):
+    """Triangulate shape, returning a Mesh with outward facing triangles
+
+    In adaptive mode each face gets its own angular deflection, worked out from its
+    curvature (see adaptive_angle), so the linear deflection should be absolute.
+    """
+    from OCP.BRep import BRep_Tool
+    from OCP.BRepMesh import BRepMesh_IncrementalMesh
+    from OCP.TopAbs import TopAbs_REVERSED
+    from OCP.TopLoc import TopLoc_Location
+
+    if adaptive:
+        if relative:
+            raise ValueError(
+                "Adaptive tessellation needs an absolute linear deflection"
+            )
+        mesh_faces_adaptively(shape, linear_deflection, angular_deflection)
+    else:
+        BRepMesh_IncrementalMesh(
+            shape.wrapped, linear_deflection, relative, angular_deflection, True
+        )
+
+    vertices = []
+    triangles = []
+    offset = 0
+    for face in shape.faces():
+        loc = TopLoc_Location()
+        poly = BRep_Tool.Triangulation_s(face.wrapped, loc)
+        if poly is None:
+            continue
+        trsf = loc.Transformation()
+        nodes = np.array(
+            [poly.Node(i).Coord() for i in range(1, poly.NbNodes() + 1)], dtype=float
+        )
+        matrix = np.array(
+            [[trsf.Value(r, c) for c in range(1, 5)] for r in range(1, 4)]
+        )
+        nodes = nodes @ matrix[:, :3].T + matrix[:, 3]
+
+        tris = np.array(
+            [poly.Triangle(i).Get() for i in range(1, poly.NbTriangles() + 1)],
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        tris -= 1  # OCC indices start at 1
+        if face.wrapped.Orientation() == TopAbs_REVERSED:
+            tris = tris[:, [0, 2, 1]]
+
+        vertices.append(nodes)
+        triangles.append(tris + offset)
+        offset += len(nodes)
+
+    if not vertices:
+        return Mesh(np.empty((0, 3)), np.empty((0, 3), dtype=np.int64))
+    return Mesh(np.concatenate(vertices), np.concatenate(triangles))
+
+
+def timed_tessellate(shape, **kwargs):
+    start = time.perf_counter()
+    mesh = tessellate(shape, **kwargs)
+    return mesh, time.perf_counter() - start
+
+
+def tessellate_brep(data, **kwargs):
+    """Worker function: tessellate a shape sent over as BREP bytes"""
+    return timed_tessellate(shape_from_brep(data), **kwargs)
+
+
+def tessellate_all(shapes, processes=None, quality=None, adaptive=None):
+    """Tessellate each shape in a pool of worker processes, returning a list of Meshes
+
+    Args:
+        shapes: the shapes to tessellate
+        processes: the number of workers, defaulting to one per shape up to the number
+            of CPUs. With a single worker everything is done in this process.
+        quality: name of the quality profile, defaulting to the one set by set_quality
+        adaptive: use the curvature to decide how finely to tessellate each face
+    """
+    shapes = list(shapes)
+    if processes is None:
+        processes = min(len(shapes), os.cpu_count() or 1)
+    if processes <= 1:
+        return list(tessellate_each(shapes, quality, adaptive))
+
+    kwargs = tessellation_settings(quality, adaptive)
+    payloads = [shape_to_brep(shape) for shape in shapes]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(tessellate_brep, data, **kwargs) for data in payloads]
+        results = [future.result() for future in futures]
+
+    for shape, (mesh, seconds) in zip(shapes, results):
+        record_tessellation(shape, mesh, seconds)
+    return [mesh for mesh, _ in results]
+
+
+def tessellate_each(shapes, quality=None, adaptive=None):
+    """Tessellate the shapes one at a time in this process, yielding each Mesh in turn
+
+    Unlike tessellate_all, only one of the meshes needs to be kept at once, e.g. when
+    passing them straight on to write_stl.
+    """
+    kwargs = tessellation_settings(quality, adaptive)
+    for shape in shapes:
+        mesh, seconds = timed_tessellate(shape, **kwargs)
+        record_tessellation(shape, mesh, seconds)
+        yield mesh
+
+
+def record_tessellation(shape, mesh, seconds):
+    tessellation_stats.append(
+        (shape.label or type(shape).__name__, len(mesh.triangles), seconds)
+    )
+    memory.record_shape(shape, mesh)
+
+
+def report_tessellation(file=None):
+    """Print the triangle count and time taken for each tessellated shape"""
+    file = file or sys.stderr
+    if not tessellation_stats:
+        return
+    settings = default_quality["quality"] or "default"
+    if default_quality["adaptive"]:
+        settings = f"{default_quality['quality'] or 'print'}, adaptive"
+    width = max(len(label) for label, _, _ in tessellation_stats)
+    print(f"Tessellation ({settings}):", file=file)
+    for label, triangles, seconds in tessellation_stats:
+        print(
+            f"  {label:<{width}}  {triangles:8d} triangles  {seconds:8.3f}s", file=file
+        )
+
+
+def triangle_normals(vertices, triangles):
+    """Unit normals of the triangles, zero for degenerate triangles"""
+    corners = vertices[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+
+def stl_records(mesh):
+    """The binary STL records for a mesh"""
+    records = np.zeros(len(mesh.triangles), dtype=STL_DTYPE)
+    records["normal"] = triangle_normals(mesh.vertices, mesh.triangles)
+    records["vertices"] = mesh.vertices[mesh.triangles]
+    return records
+
+
+def mesh_volume(mesh):
+    """The enclosed volume of a closed, outward facing mesh"""
+    corners = mesh.vertices[mesh.triangles]
+    return (
+        np.einsum(
+            "ij,ij->i", corners[:, 0], np.cross(corners[:, 1], corners[:, 2])
+        ).sum()
+        / 6
+    )
+
+
+def transformed(mesh, matrix):
+    """Return a copy of the mesh moved by a 4x4 transform"""
+    return Mesh(mesh.vertices @ matrix[:3, :3].T + matrix[:3, 3], mesh.triangles)
+
+
+def weld(mesh, digits=6):
+    """Merge coincident vertices and drop the triangles that collapse as a result"""
+    keys = np.round(mesh.vertices, digits)
+    vertices, inverse = np.unique(keys, axis=0, return_inverse=True)
+    triangles = inverse.reshape(-1)[mesh.triangles]
+    keep = (
+        (triangles[:, 0] != triangles[:, 1])
+        & (triangles[:, 1] != triangles[:, 2])
+        & (triangles[:, 2] != triangles[:, 0])
+    )
+    return Mesh(vertices, triangles[keep])
+
+
+class StlWriter:
+    """Write a binary STL file a mesh at a time, without holding on to the meshes
+
+    The triangle count in the header is only known at the end, so a zero is written in
+    its place to begin with and patched once the writer is closed::
+
+        with StlWriter(path) as writer:
+            for shape in shapes:
+                writer.write(tessellate(shape))
+    """
+
+    def __init__(self, path, header=b"build123d"):
+        self.path = path
+        self.count = 0
+        self.file = open(path, "wb")
+        self.file.write(header[:80].ljust(80, b"\0"))
+        self.file.write(b"\0\0\0\0")
+
+    def write(self, mesh):
+        # A chunk at a time, so the records of a huge mesh aren't all made at once
+        for start in range(0, len(mesh.triangles), STL_CHUNK):
+            chunk = Mesh(mesh.vertices, mesh.triangles[start : start + STL_CHUNK])
+            self.file.write(stl_records(chunk).tobytes())
+        self.count += len(mesh.triangles)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.seek(80)
+        self.file.write(np.array(self.count, dtype="<u4").tobytes())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def write_stl(path, meshes, header=b"build123d"):
+    """Write the meshes into a single binary STL file
+
+    meshes can be a generator, in which case only one of them is held at a time.
+    """
+    with StlWriter(path, header) as writer:
+        for mesh in meshes:
+            writer.write(mesh)
+    return path
+
+
+def write_3mf(path, objects, unit="MilliMeter"):
+    """Write a 3MF file with one mesh object per unique part, placed once per instance
+
+    Args:
+        path: the file to write
+        objects: (name, mesh, transforms) tuples, where the transforms are the 4x4
+            matrices placing each instance of the mesh on the build plate
+        unit: the name of a Lib3MF.ModelUnit
+    """
+    import ctypes
+
+    from lib3mf import Lib3MF
+
+    wrapper = Lib3MF.Wrapper(os.path.join(os.path.dirname(Lib3MF.__file__), "lib3mf"))
+    model = wrapper.CreateModel()
+    model.SetUnit(getattr(Lib3MF.ModelUnit, unit))
+    for name, mesh, transforms in objects:
+        mesh = weld(mesh)
+        c_float3 = ctypes.c_float * 3
+        c_uint3 = ctypes.c_uint * 3
+        mesh_3mf = model.AddMeshObject()
+        mesh_3mf.SetGeometry(
+            [Lib3MF.Position(c_float3(*v)) for v in mesh.vertices.tolist()],
+            [Lib3MF.Triangle(c_uint3(*t)) for t in mesh.triangles.tolist()],
+        )
+        if name:
+            mesh_3mf.SetName(name)
+        for matrix in transforms:
+            # 3MF transforms act on row vectors, so the rotation is transposed and the
+            # translation is the last row.
+            transform = wrapper.GetIdentityTransform()
+            for row in range(3):
+                for col in range(3):
+                    transform.Fields[row][col] = matrix[col][row]
+                transform.Fields[3][row] = matrix[row][3]
+            model.AddBuildItem(mesh_3mf, transform)
+    model.QueryWriter("3mf").WriteToFile(os.fsdecode(path))
+    return path
+
+
+def read_stl(path, digits=6):
+    """Read a binary or ASCII STL file into a welded Mesh"""
+    data = Path(path).read_bytes()
+    count = int(np.frombuffer(data[80:84], dtype="<u4")[0]) if len(data) >= 84 else -1
+    if len(data) == 84 + count * STL_DTYPE.itemsize:
+        records = np.frombuffer(data, dtype=STL_DTYPE, count=count, offset=84)
+        corners = records["vertices"].astype(float)
+    else:
+        numbers = re.findall(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)", data)
+        corners = np.array(numbers, dtype=float).reshape(-1, 3, 3)
+    triangles = np.arange(len(corners) * 3).reshape(-1, 3)
+    return weld(Mesh(corners.reshape(-1, 3), triangles), digits)
+
+
+def triangle_edges(triangles):
+    """All the edges of the triangles as (3m, 2) vertex index pairs, smallest first"""
+    edges = np.concatenate(
+        [triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]]
+    )
+    return np.sort(edges, axis=1)
+
+
+def boundary_edges(triangles):
+    """The edges used by only one of the triangles, i.e. the outlines of a patch"""
+    edges, counts = np.unique(triangle_edges(triangles), axis=0, return_counts=True)
+    return edges[counts == 1]
+
+
+def connected_components(elements, vertex_count):
+    """Label the groups of elements (triangles, edges) connected by shared vertices
+
+    Returns an array with a component number for each element, numbered from zero.
+    """
+    labels = np.arange(vertex_count)
+    while True:
+        # Spread the smallest label through each element until nothing changes
+        element_min = labels[elements].min(axis=1)
+        updated = labels.copy()
+        for column in elements.T:
+            np.minimum.at(updated, column, element_min)
+        # Jump straight to each label's own label, to converge in fewer passes
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return np.unique(labels[elements[:, 0]], return_inverse=True)[1]
@@ -0,0 +1,165 @@
+"""
+Turn a triangle mesh back into build123d faces, merging the coplanar triangles.
+
+Reading an STL file with the build123d ``Mesher`` gives a face for every triangle, so a
+flat top made of a few hundred triangles is a few hundred faces, and anything done with
+them (fusing them into a Sketch, say) pays for every one. Here the triangles are first
+grouped by the plane they lie in, and each connected group sharing edges becomes a single
+polygon face, with holes where the group has holes::
+
+    faces = planar_faces(read_stl(path))
+
+Triangles that have no coplanar neighbours, like those of curved surfaces, are kept as
+faces of their own, as are those of groups whose outlines can't be followed, e.g. as
+some of their triangles are wound the other way.
+"""
+
+import numpy as np
+
+from model_tools.mesh import connected_components, triangle_normals
+
+# Triangles are coplanar when their normals and offsets round to the same values
+NORMAL_DIGITS = 5
+OFFSET_DIGITS = 4
+# Relative cross product below which a polygon vertex counts as on a straight line
+COLLINEAR_TOLERANCE = 1e-9
+
+
+def plane_labels(mesh):
+    """Label the triangles by the plane they lie in, returning (labels, normals)"""
+    normals = triangle_normals(mesh.vertices, mesh.triangles)
+    offsets = np.einsum("ij,ij->i", normals, mesh.vertices[mesh.triangles[:, 0]])
+    planes = np.column_stack(
+        [np.round(normals, NORMAL_DIGITS), np.round(offsets, OFFSET_DIGITS)]
+    )
+    # Avoid -0.0 and 0.0 being different planes
+    planes += 0.0
+    return np.unique(planes, axis=0, return_inverse=True)[1].reshape(-1), normals
+
+
+def coplanar_patches(mesh):
+    """Label the connected groups of coplanar triangles sharing edges"""
+    count = len(mesh.triangles)
+    planes, normals = plane_labels(mesh)
+    # Every directed edge of every triangle, keyed by its plane and vertices
+    triangle = np.tile(np.arange(count), 3)
+    edges = np.sort(
+        np.concatenate(
+            [
+                mesh.triangles[:, [0, 1]],
+                mesh.triangles[:, [1, 2]],
+                mesh.triangles[:, [2, 0]],
+            ]
+        ),
+        axis=1,
+    )
+    keys = np.column_stack([planes[triangle], edges])
+    order = np.lexsort(keys.T[::-1])
+    same = np.all(keys[order][1:] == keys[order][:-1], axis=1)
+    # Triangles sharing an edge in the same plane, and each triangle with itself, so
+    # the ones on their own get a label too
+    pairs = np.concatenate(
+        [
+            np.column_stack([triangle[order][:-1][same], triangle[order][1:][same]]),
+            np.column_stack([np.arange(count)] * 2),
+        ]
+    )
+    return connected_components(pairs, count)[-count:], normals
+
+
+def boundary_loops(triangles):
+    """The outlines of a patch of triangles, as lists of vertex indices following the
+    winding of the triangles, or None if the outlines touch themselves or the triangles
+    aren't all wound the same way"""
+    directed = np.concatenate(
+        [triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]]
+    )
+    if len(np.unique(directed, axis=0)) < len(directed):
+        # Neighbours wound the same way run along the edge they share in the same
+        # direction, and then the outline can't be followed around
+        return None
+    _, undirected, counts = np.unique(
+        np.sort(directed, axis=1), axis=0, return_inverse=True, return_counts=True
+    )
+    # The edges only one of the triangles has
+    boundary = directed[counts[undirected.reshape(-1)] == 1]
+    following = dict(zip(boundary[:, 0].tolist(), boundary[:, 1].tolist()))
+    if len(following) < len(boundary):
+        # A vertex the outline passes through twice, so it's ambiguous where it goes
+        return None
+    loops = []
+    while following:
+        start, vertex = following.popitem()
+        loop = [start]
+        while vertex != start:
+            loop.append(vertex)
+            vertex = following.pop(vertex, None)
+            if vertex is None:
+                return None  # the outline doesn't close
+        loops.append(loop)
+    return loops
+
+
+def without_collinear(points):
+    """Drop the points of a closed polygon lying on a straight line between the others"""
+    before = points - np.roll(points, 1, axis=0)
+    after = np.roll(points, -1, axis=0) - points
+    cross = np.linalg.norm(np.cross(before, after), axis=1)
+    scale = np.linalg.norm(before, axis=1) * np.linalg.norm(after, axis=1)
+    keep = cross > COLLINEAR_TOLERANCE * scale
+    return points[keep] if keep.sum() >= 3 else points
+
+
+def signed_area(points, normal):
+    """The area of a closed polygon, positive if it winds anticlockwise about normal"""
+    return np.dot(np.cross(points, np.roll(points, -1, axis=0)).sum(axis=0), normal) / 2
+
+
+def polygon_face(outer, holes=()):
+    """A planar build123d Face from the points of its outline and holes"""
+    from build123d import Face
+    from OCP.BRepBuilderAPI import BRepBuilderAPI_MakeFace, BRepBuilderAPI_MakePolygon
+    from OCP.gp import gp_Pnt
+
+    # Straight from OCP, as there can be thousands of these, and it's ~4x quicker than
+    # going through Wire.make_polygon
+    def polygon(points):
+        maker = BRepBuilderAPI_MakePolygon()
+        for point in points.tolist():
+            maker.Add(gp_Pnt(*point))
+        maker.Close()
+        return maker.Wire()
+
+    maker = BRepBuilderAPI_MakeFace(polygon(outer), True)
+    for hole in holes:
+        maker.Add(polygon(hole))
+    return Face(maker.Face())
+
+
+def planar_faces(mesh):
+    """Build123d faces for a mesh, one for each connected group of coplanar triangles"""
+    patches, normals = coplanar_patches(mesh)
+    order = np.argsort(patches, kind="stable")
+    starts = np.flatnonzero(np.diff(patches[order], prepend=-1))
+    faces = []
+    for patch in np.split(order, starts[1:]):
+        triangles = mesh.triangles[patch]
+        loops = boundary_loops(triangles) if len(patch) > 1 else None
+        if loops is None:
+            faces.extend(polygon_face(mesh.vertices[t]) for t in triangles)
+            continue
+
+        # Put the outlines exactly in the plane, so the face can be made from them
+        normal = normals[patch].mean(axis=0)
+        normal /= np.linalg.norm(normal)
+        offset = np.mean(mesh.vertices[triangles.reshape(-1)] @ normal)
+        outlines = []
+        for loop in loops:
+            points = mesh.vertices[loop]
+            points = points - np.outer(points @ normal - offset, normal)
+            outlines.append(without_collinear(points))
+        # The outer outline winds with the triangles, the holes against them
+        outlines.sort(key=lambda points: signed_area(points, normal), reverse=True)
+        outer, *holes = outlines
+        faces.append(polygon_face(outer, holes))
+    return faces
@@ -0,0 +1,362 @@
+"""
+Lay parts out on build plates, packed by the outlines of their footprints.
+
+The footprint of each part (its outline seen from above) is rasterised from its
+triangles into a grid of cells, once for every angle it may be turned by. The parts are
+then placed biggest first, each at the lowest, then leftmost, spot on the first plate it
+fits on without coming closer than the spacing to anything already there::
+
+    layout = nest_shapes(parts, bed_size=(256, 256), spacing=5)
+    report(layout)
+
+How much a part overlaps the parts on a plate, at every position on the plate at once,
+is a correlation of the two grids, worked out with FFTs. A part that didn't fit on a
+plate is never tried on it again, and copies of the same part share their footprints,
+so hundreds of parts only take a few seconds.
+"""
+
+import math
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+# The size of the cells footprints are rasterised into, in mm
+RESOLUTION = 0.5
+# The angles parts may be turned by about Z, in degrees
+ANGLES = (0, 90)
+# The gap left between parts, in mm
+SPACING = 5
+# The tessellation quality the footprints of shapes are taken from
+FOOTPRINT_QUALITY = "preview"
+# How many (triangle, cell) pairs are tested at a time when rasterising
+CELLS_PER_CHUNK = 1 << 18
+
+# mask: the cells covered by the part, the first row being the lowest in Y. corner: the
+# (x, y) of the lower left corner of the first cell. area: the part's footprint in mm².
+Footprint = namedtuple("Footprint", "mask corner area")
+# plate: which plate the part is on, from 0. The part is turned by angle degrees about Z
+# and then moved by (x, y).
+Placement = namedtuple("Placement", "plate x y angle")
+# The placement of each part, and the fraction of each plate the parts cover
+Layout = namedtuple("Layout", "placements utilisation bed_size spacing")
+
+
+def cross2(a, b):
+    """The Z component of the cross product of 2D vectors"""
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def turned(points, angle):
+    """2D points turned anticlockwise about the origin by angle degrees"""
+    radians = math.radians(angle)
+    cos, sin = math.cos(radians), math.sin(radians)
+    return points @ np.array([[cos, sin], [-sin, cos]])
+
+
+def footprint(mesh, angle=0, resolution=RESOLUTION):
+    """Rasterise the outline of a mesh seen from above, turned by angle degrees
+
+    Every cell any of the triangles touches is covered, so parts kept apart by their
+    masks never touch, however thin their features.
+    """
+    points = turned(mesh.vertices[:, :2], angle)
+    corner = np.floor(points.min(axis=0) / resolution) * resolution
+    shape = np.maximum(np.ceil((points.max(axis=0) - corner) / resolution), 1)
+    mask = np.zeros(shape.astype(int)[::-1], dtype=bool)
+    centred = np.zeros_like(mask)
+
+    corners = points[mesh.triangles]
+    edges = np.roll(corners, -1, axis=1) - corners
+    doubled_area = cross2(edges[:, 0], edges[:, 1])
+    # Seen from above the walls are just lines, which the faces around them cover
+    flat = np.abs(doubled_area) > 1e-9
+    corners, edges = corners[flat], edges[flat]
+    # Which side of the edges the inside of each triangle is on
+    sides = np.sign(doubled_area[flat])
+    # A cell touches a triangle if its centre is within half a diagonal of it
+    slack = resolution * math.sqrt(0.5) * np.linalg.norm(edges, axis=2)
+
+    low = np.floor((corners.min(axis=1) - corner) / resolution).astype(int)
+    high = np.ceil((corners.max(axis=1) - corner) / resolution).astype(int)
+    low = np.maximum(low, 0)
+    high = np.maximum(np.minimum(high, shape.astype(int)), low + 1)
+    spans = high - low
+    counts = spans[:, 0] * spans[:, 1]
+    ends = np.cumsum(counts)
+    # Test every triangle against each of the cells in its bounding box, a chunk of
+    # the triangles at a time
+    cuts = np.searchsorted(ends, np.arange(CELLS_PER_CHUNK, ends[-1], CELLS_PER_CHUNK))
+    for chunk in np.split(np.arange(len(counts)), np.unique(cuts)):
+        if not len(chunk):
+            continue
+        owners = np.repeat(chunk, counts[chunk])
+        offsets = np.arange(len(owners)) - np.repeat(
+            ends[chunk] - counts[chunk], counts[chunk]
+        )
+        cells = low[owners] + np.column_stack(
+            [offsets % spans[owners, 0], offsets // spans[owners, 0]]
+        )
+        centres = corner + (cells + 0.5) * resolution
+        inside = cross2(edges[owners], centres[:, None] - corners[owners])
+        inside *= sides[owners, None]
+        touched = np.all(inside >= -slack[owners], axis=1)
+        mask[cells[touched, 1], cells[touched, 0]] = True
+        covered = np.all(inside >= 0, axis=1)
+        centred[cells[covered, 1], cells[covered, 0]] = True
+    # The cells whose centres are in the footprint are as likely to stick out of it as
+    # not, so they give its area
+    return Footprint(mask, tuple(corner), centred.sum() * resolution**2)
+
+
+def grown(mask, radius):
+    """The mask grown by radius cells all round, padded by as many whole cells"""
+    pad = int(radius)
+    padded = np.pad(mask, pad)
+    sums = np.pad(np.cumsum(padded, axis=1), ((0, 0), (1, 0)))
+    columns = np.arange(padded.shape[1])
+    rows = {}
+    result = np.zeros_like(padded)
+    for shift in range(-pad, pad + 1):
+        # Grow along the rows as far as the circle reaches this many rows up or down
+        reach = int(math.sqrt(radius**2 - shift**2))
+        if reach not in rows:
+            start = np.maximum(columns - reach, 0)
+            stop = np.minimum(columns + reach + 1, padded.shape[1])
+            rows[reach] = sums[:, stop] - sums[:, start] > 0
+        result |= np.roll(rows[reach], shift, axis=0)
+    return result
+
+
+def fft_length(n):
+    """The smallest length from n up with no prime factors above 5, which FFT quickly"""
+    while True:
+        rest = n
+        for factor in (2, 3, 5):
+            while rest % factor == 0:
+                rest //= factor
+        if rest == 1:
+            return n
+        n += 1
+
+
+class Spectra:
+    """The spectra of a part's footprints, worked out as they're needed"""
+
+    def __init__(self, footprints, radius, fft_shape):
+        self.footprints = footprints
+        self.radius = radius
+        self.fft_shape = fft_shape
+        self.kernels = {}
+        self.masks = {}
+
+    def kernel(self, angle):
+        """The footprint grown by the spacing, ready to correlate with a plate"""
+        if angle not in self.kernels:
+            mask = grown(self.footprints[angle].mask, self.radius)
+            self.kernels[angle] = np.conj(np.fft.rfft2(mask, self.fft_shape))
+        return self.kernels[angle]
+
+    def mask(self, angle):
+        if angle not in self.masks:
+            mask = self.footprints[angle].mask
+            self.masks[angle] = np.fft.rfft2(mask, self.fft_shape)
+        return self.masks[angle]
+
+
+class Plate:
+    """The cells taken by the parts on a plate, padded all round by the spacing, kept
+    as their spectrum"""
+
+    def __init__(self, cells, pad, fft_shape):
+        self.cells = cells
+        self.pad = pad
+        self.spectrum = np.zeros((fft_shape[0], fft_shape[1] // 2 + 1), dtype=complex)
+        self.fft_shape = fft_shape
+        self.count = 0
+        self.area = 0.0
+        # The parts that didn't fit, which never will as the plate only gets fuller
+        self.full = set()
+
+    def find_spot(self, spectra):
+        """The lowest spot any of the part's footprints fit in on the plate, as
+        (row, column, angle), or None"""
+        best = None
+        for angle, fp in spectra.footprints.items():
+            rows, columns = fp.mask.shape
+            if rows > self.cells[0] or columns > self.cells[1]:
+                continue
+            if self.count:
+                # How many taken cells the grown footprint covers, at every position
+                overlaps = np.fft.irfft2(
+                    self.spectrum * spectra.kernel(angle), self.fft_shape
+                )
+                free = overlaps[
+                    : self.cells[0] - rows + 1, : self.cells[1] - columns + 1
+                ]
+                free = free < 0.5
+                if not free.any():
+                    continue
+                row = np.argmax(free.any(axis=1))
+                column = np.argmax(free[row])
+            else:
+                row = column = 0
+            # Keep the tops of the parts on the plate as low as possible
+            if best is None or (row + rows, column) < best[0]:
+                best = ((row + rows, column), (row, column, angle))
+        return best and best[1]
+
+    def add(self, spectra, row, column, angle):
+        """Take the cells under a footprint, by adding its spectrum moved into place"""
+        shift = [
+            np.exp(-2j * np.pi * (offset + self.pad) * np.arange(n) / length)
+            for offset, n, length in zip(
+                (row, column), self.spectrum.shape, self.fft_shape
+            )
+        ]
+        self.spectrum += spectra.mask(angle) * np.outer(*shift)
+        self.count += 1
+        self.area += spectra.footprints[angle].area
+
+
+def nest(parts, bed_size, spacing=SPACING, resolution=RESOLUTION):
+    """Place the parts on as few plates as they fit on, biggest first
+
+    Args:
+        parts: for each part, its footprint at each angle it may be turned by, as
+            {angle: Footprint}. Copies of a part can share the same dict, so their
+            footprints are only grown once.
+        bed_size: the (width, depth) of a plate in mm, centred on the origin
+        spacing: the gap to keep between parts in mm
+
+    Returns a Layout, with the placements in the same order as the parts.
+    """
+    width, depth = bed_size
+    cells = int(depth // resolution), int(width // resolution)
+    # Cells with centres further apart than the spacing plus a diagonal can't have
+    # anything in them closer together than the spacing
+    radius = spacing / resolution + math.sqrt(2)
+    pad = int(radius)
+    fft_shape = tuple(fft_length(n + 2 * pad) for n in cells)
+
+    first = {}
+    for index, footprints in enumerate(parts):
+        first.setdefault(id(footprints), index)
+    order = sorted(
+        range(len(parts)),
+        key=lambda index: (
+            -max(fp.area for fp in parts[index].values()),
+            first[id(parts[index])],
+        ),
+    )
+
+    plates = []
+    placements = [None] * len(parts)
+    spectra = None
+    for index in order:
+        footprints = parts[index]
+        if spectra is None or spectra.footprints is not footprints:
+            # Copies of a part come one after another, so only the current part's
+            # spectra need keeping
+            spectra = Spectra(footprints, radius, fft_shape)
+        for plate_number, plate in enumerate(plates):
+            if id(footprints) in plate.full:
+                continue
+            spot = plate.find_spot(spectra)
+            if spot is not None:
+                break
+            plate.full.add(id(footprints))
+        else:
+            plate_number, plate = len(plates), Plate(cells, pad, fft_shape)
+            spot = plate.find_spot(spectra)
+            if spot is None:
+                raise ValueError(
+                    f"Part {index} doesn't fit on a {width:g}x{depth:g}mm plate"
+                )
+            plates.append(plate)
+
+        row, column, angle = spot
+        plate.add(spectra, row, column, angle)
+        corner = footprints[angle].corner
+        placements[index] = Placement(
+            plate_number,
+            -width / 2 + column * resolution - corner[0],
+            -depth / 2 + row * resolution - corner[1],
+            angle,
+        )
+
+    utilisation = [float(plate.area / (width * depth)) for plate in plates]
+    return Layout(placements, utilisation, tuple(bed_size), spacing)
+
+
+def nest_shapes(
+    shapes, bed_size, spacing=SPACING, angles=ANGLES, resolution=RESOLUTION
+):
+    """Lay build123d shapes out on plates, moving each of them into place
+
+    The footprints are taken from a tessellation of each distinct geometry (see
+    group_instances). Each shape's plate number (from 0) is stored in its ``plate``
+    attribute, and the Layout, which is also returned, in its ``layout`` attribute, so
+    whatever exports the shapes can tell where they go (see plate_of and layout_of).
+    """
+    from build123d import Pos, Rot
+
+    from model_tools.instances import group_instances
+    from model_tools.mesh import (
+        shape_from_brep,
+        shape_to_brep,
+        tessellate,
+        tessellation_settings,
+    )
+
+    shapes = list(shapes)
+    footprints = {}
+    for group in group_instances(shapes):
+        # Tessellate a copy, so the shape isn't left with these triangles when it's
+        # exported at another quality
+        mesh = tessellate(
+            shape_from_brep(shape_to_brep(group.prototype)),
+            **tessellation_settings(FOOTPRINT_QUALITY, adaptive=False),
+        )
+        group_footprints = {
+            angle: footprint(mesh, angle, resolution) for angle in angles
+        }
+        for shape in group.instances:
+            footprints[id(shape)] = group_footprints
+
+    layout = nest(
+        [footprints[id(shape)] for shape in shapes], bed_size, spacing, resolution
+    )
+    for shape, placement in zip(shapes, layout.placements):
+        shape.locate(Pos(placement.x, placement.y) * Rot(0, 0, placement.angle))
+        shape.plate = placement.plate
+        shape.layout = layout
+    return layout
+
+
+def plate_of(shape):
+    """The plate nest_shapes put a shape on, or 0 if it wasn't laid out"""
+    return getattr(shape, "plate", 0)
+
+
+def layout_of(shapes):
+    """The Layout nest_shapes laid the shapes out in, or None if they weren't all laid
+    out together"""
+    layouts = [getattr(shape, "layout", None) for shape in shapes]
+    if layouts and all(layout is layouts[0] for layout in layouts):
+        return layouts[0]
+    return None
+
+
+def report(layout, file=None):
+    """Print how many parts are on each plate, and how much of it they cover"""
+    file = file or sys.stderr
+    width, depth = layout.bed_size
+    print(
+        f"Layout ({width:g}x{depth:g}mm plates, {layout.spacing:g}mm apart):", file=file
+    )
+    for plate, utilisation in enumerate(layout.utilisation):
+        count = sum(placement.plate == plate for placement in layout.placements)
+        print(
+            f"  Plate {plate + 1}  {count:4d} parts  {utilisation:6.1%} used", file=file
+        )
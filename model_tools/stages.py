@@ -0,0 +1,135 @@
+"""
+Build a model as a graph of named stages, only redoing the stages whose inputs changed.
+
+Each stage is a function. The names of its arguments say what it depends on: arguments
+named after another stage get that stage's result, and the rest are model parameters::
+
+    stages = StageGraph()
+
+    @stages.stage
+    def body(height, width):
+        return Box(width, width, height)
+
+    @stages.stage(files=[logo_path])
+    def logo(logo_scale):
+        ...
+
+    @stages.stage
+    def part(body, logo):
+        return body - logo
+
+    results = stages.run(height=10, width=20, logo_scale=0.25)
+
+Every stage result is memoized under a key made from the stage's source, the values of
+the parameters it takes, the SHA-256 of the files it declares and the keys of the stages
+it takes the results of. Changing one parameter therefore only reruns the stages that
+(directly or through other stages) depend on it. The last result of each stage is kept
+in memory for repeated builds in the same process, and shapes are also kept in the part
+cache on disk, so they survive between runs. Turning off the part cache turns this off
+too.
+"""
+
+import copy
+import inspect
+
+from model_tools.cache import file_sha256, part_cache
+from model_tools.trace import stage as trace_stage
+
+
+class Stage:
+    def __init__(self, func, files=()):
+        self.func = func
+        self.name = func.__name__
+        self.files = list(files)
+        self.arguments = list(inspect.signature(func).parameters)
+
+
+class StageGraph:
+    """Named stages, run in dependency order with their results memoized"""
+
+    def __init__(self, cache=part_cache):
+        self.cache = cache
+        self.stages = {}
+        # {stage name: (key, result)} of the last result of each stage
+        self.memo = {}
+        # How each stage's result was last come by: "built", "memory" or "disk"
+        self.last_run = {}
+
+    def stage(self, func=None, files=()):
+        """Decorator adding a stage, optionally depending on the contents of files"""
+        if func is None:
+            return lambda func: self.stage(func, files)
+        self.stages[func.__name__] = Stage(func, files)
+        return func
+
+    def order(self):
+        """The stages, sorted so that every stage comes after the stages it uses"""
+        ordered, visiting = [], set()
+
+        def visit(name, path):
+            if name in visiting:
+                raise ValueError(f"Stages depend on each other: {' -> '.join(path)}")
+            if self.stages[name] in ordered:
+                return
+            visiting.add(name)
+            for argument in self.stages[name].arguments:
+                if argument in self.stages:
+                    visit(argument, path + [argument])
+            visiting.discard(name)
+            ordered.append(self.stages[name])
+
+        for name in self.stages:
+            visit(name, [name])
+        return ordered
+
+    def run(self, **params):
+        """Run the stages given the model parameters, returning {stage name: result}"""
+        results, keys = {}, {}
+        self.last_run = {}
+        for stage in self.order():
+            missing = [
+                name
+                for name in stage.arguments
+                if name not in self.stages and name not in params
+            ]
+            if missing:
+                raise KeyError(f"Stage {stage.name!r} needs {', '.join(missing)}")
+            kwargs = {
+                name: results[name] if name in self.stages else params[name]
+                for name in stage.arguments
+            }
+            inputs = {
+                name: keys[name] if name in self.stages else params[name]
+                for name in stage.arguments
+            }
+            inputs["files"] = [file_sha256(path) for path in stage.files]
+            keys[stage.name] = self.cache.key(stage.func, inputs)
+            results[stage.name] = self._result(stage, keys[stage.name], kwargs)
+        return results
+
+    def _result(self, stage, key, kwargs):
+        if not self.cache.enabled:
+            with trace_stage(stage.name):
+                self.last_run[stage.name] = "built"
+                return stage.func(**kwargs)
+
+        memo_key, result = self.memo.get(stage.name, (None, None))
+        if memo_key == key:
+            self.last_run[stage.name] = "memory"
+            # Shapes get moved and relabelled by the models, so hand out copies
+            return copy.copy(result)
+        result = None
+        if self.cache.path(key).exists():
+            with trace_stage(f"{stage.name} (cached)"):
+                result = self.cache.get(key)
+        if result is not None:
+            self.last_run[stage.name] = "disk"
+        else:
+            with trace_stage(stage.name):
+                result = stage.func(**kwargs)
+            self.last_run[stage.name] = "built"
+            # Only shapes can go in the part cache, anything else is just memoized
+            if hasattr(result, "wrapped"):
+                self.cache.put(key, result)
+        self.memo[stage.name] = (key, result)
+        return copy.copy(result)
@@ -0,0 +1,103 @@
+"""
+Import the faces of an SVG file, such as a logo to engrave, without redoing it every build.
+
+The faces are kept in the part cache, keyed by the SHA-256 of the SVG file and the scale
+and simplification tolerance they were made with, so a rebuild only reads a BREP file
+instead of parsing the SVG again.
+
+SVG outlines tend to be made of lots of short Bezier curves, and every one of them makes
+the boolean cutting the logo into a part more expensive. With a tolerance, each smooth run
+of curves between two corners is replaced by a single B-spline fitted to within the
+tolerance of the original, leaving far fewer edges to intersect. Straight lines and the
+corners between edges are kept as they are.
+"""
+
+from pathlib import Path
+
+from model_tools.cache import file_sha256, part_cache
+
+# Edges meeting at more than this many degrees form a corner, which is kept as is
+CORNER_ANGLE = 10
+# How many points along each edge the simplified curves are fitted through
+SAMPLES_PER_EDGE = 16
+
+
+def start_direction(edge):
+    # Measured over a short step, as SVG curves can have zero length tangents at the ends
+    return ((edge @ 1e-3) - (edge @ 0)).normalized()
+
+
+def end_direction(edge):
+    return ((edge @ 1) - (edge @ (1 - 1e-3))).normalized()
+
+
+def simplify_wire(wire, tolerance):
+    """Replace each smooth run of curves in wire by one B-spline within tolerance"""
+    from build123d import Edge, GeomType, Wire
+
+    edges = wire.order_edges()
+    runs = [[edges[0]]]
+    for previous, edge in zip(edges, edges[1:]):
+        if end_direction(previous).get_angle(start_direction(edge)) > CORNER_ANGLE:
+            runs.append([edge])
+        else:
+            runs[-1].append(edge)
+    # Where the wire closes smoothly, the first and last runs are really the same run
+    smooth_close = (
+        end_direction(edges[-1]).get_angle(start_direction(edges[0])) <= CORNER_ANGLE
+    )
+    if len(runs) > 1 and smooth_close:
+        runs[0] = runs.pop() + runs[0]
+
+    simplified = []
+    for run in runs:
+        if len(run) == 1 and run[0].geom_type == GeomType.LINE:
+            simplified.append(run[0])
+            continue
+        points = [run[0] @ 0] + [
+            edge @ (i / SAMPLES_PER_EDGE)
+            for edge in run
+            for i in range(1, SAMPLES_PER_EDGE + 1)
+        ]
+        simplified.append(Edge.make_spline_approx(points, tol=tolerance))
+    return Wire(simplified)
+
+
+def simplify_face(face, tolerance):
+    from build123d import Face
+
+    return Face(
+        simplify_wire(face.outer_wire(), tolerance),
+        [simplify_wire(wire, tolerance) for wire in face.inner_wires()],
+    )
+
+
+def import_svg_faces(path, scale=1, tolerance=None, cache=part_cache):
+    """The faces of an SVG file, scaled about the origin and, given a tolerance (in
+    mm), simplified. Set ``cache.enabled = False`` to always import the file."""
+    from build123d import Compound, import_svg
+
+    key = None
+    if cache.enabled:
+        # The key covers the source of this function, and the simplifying code through
+        # the hash of this whole file
+        params = {
+            "svg": file_sha256(path),
+            "scale": scale,
+            "tolerance": tolerance,
+            "svg.py": file_sha256(Path(__file__)),
+        }
+        key = cache.key(import_svg_faces, params)
+        logo = cache.get(key)
+        if logo is not None:
+            cache.hits += 1
+            return logo.faces()
+        cache.misses += 1
+
+    faces = [face.scale(scale, about=(0, 0, 0)) for face in import_svg(path).faces()]
+    if tolerance:
+        faces = [simplify_face(face, tolerance) for face in faces]
+    logo = Compound(faces)
+    if key:
+        cache.put(key, logo)
+    return logo.faces()
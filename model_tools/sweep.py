@@ -0,0 +1,234 @@
+"""
+Build and export many variants of a model in parallel, e.g. for a sizing ladder.
+
+The variants are either the product of value lists given per parameter, or read from a
+JSON file holding a list of override dicts (keys may be dotted, as with --set)::
+
+    python -m model_tools.sweep ball_in_a_box --grid box_size=10,15,20,25,30
+    python -m model_tools.sweep terraforming_mars/player_mat.py \\
+        --grid body_vars.height=2.5,3,3.5 --grid big_grid_vars.cell_size=8.2,8.4
+    python -m model_tools.sweep coffee_filter_holder/coffee_filter_holder.py \\
+        --variants ladder.json
+
+Each variant is written to its own numbered directory under --output-dir, and a summary
+of every variant is written there as sweep_summary.csv and sweep_summary.json: a row for
+each STL file it exported, with its parameters, the file's volume, bounding box and
+triangle count, and the variant's build time and output paths.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from model_tools.cli import apply_overrides, load_model, model_params, parse_value
+from model_tools.mesh import QUALITY_PROFILES, mesh_volume, read_stl, set_quality
+
+
+def parse_grid(specs):
+    """Turn ["key=v1,v2", ...] into the list of override dicts for every combination"""
+    keys, choices = [], []
+    for spec in specs:
+        key, sep, values = spec.partition("=")
+        if not sep:
+            raise ValueError(f"Grid {spec!r} is not of the form key=v1,v2,...")
+        parsed = parse_value(values)
+        if not isinstance(parsed, (list, tuple)) or isinstance(parsed, str):
+            parsed = [parse_value(value.strip()) for value in values.split(",")]
+        keys.append(key.strip())
+        choices.append(list(parsed))
+    return [dict(zip(keys, combo)) for combo in itertools.product(*choices)]
+
+
+def summarize_mesh(path):
+    """Volume, bounding box and triangle count of an exported mesh file"""
+    mesh = read_stl(path)
+    size = np.ptp(mesh.vertices, axis=0) if len(mesh.vertices) else np.zeros(3)
+    return {
+        "file": Path(path).name,
+        "volume": round(float(mesh_volume(mesh)), 3),
+        "bbox_x": round(float(size[0]), 3),
+        "bbox_y": round(float(size[1]), 3),
+        "bbox_z": round(float(size[2]), 3),
+        "triangles": len(mesh.triangles),
+    }
+
+
+def summarize_outputs(paths):
+    """A summary of each exported STL file
+
+    They're kept apart rather than added up, as some files repeat parts of the others
+    (like the player mat's test grid, which is on the plate too).
+    """
+    return [
+        summarize_mesh(path) for path in paths if Path(path).suffix.lower() == ".stl"
+    ]
+
+
+def run_variant(model_spec, index, overrides, output_dir, quality=None, adaptive=False):
+    """Worker function: build and export one variant, returning its summary rows, one
+    for each STL file it exported"""
+    model = load_model(model_spec)
+    set_quality(quality, adaptive)
+    params = apply_overrides(
+        model_params(model), [f"{key}={value!r}" for key, value in overrides.items()]
+    )
+    variant_dir = Path(output_dir) / f"{index:04d}"
+    variant_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    parts = model.build(**params)
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    paths = model.export(parts, variant_dir)
+    export_seconds = time.perf_counter() - start
+
+    return [
+        {
+            "variant": index,
+            "params": json.dumps(overrides, sort_keys=True),
+            **summary,
+            "build_seconds": round(build_seconds, 3),
+            "export_seconds": round(export_seconds, 3),
+            "outputs": ";".join(str(path) for path in paths),
+        }
+        for summary in summarize_outputs(paths) or [{}]
+    ]
+
+
+def sweep(
+    model_spec, variants, output_dir, processes=None, quality=None, adaptive=False
+):
+    """Build every variant in a process pool, returning the summary rows in order"""
+    if not variants:
+        raise ValueError("There are no variants to build")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    processes = processes or min(len(variants), os.cpu_count() or 1)
+    rows = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {
+            pool.submit(
+                run_variant, model_spec, i, overrides, output_dir, quality, adaptive
+            ): i
+            for i, overrides in enumerate(variants)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                variant_rows = future.result()
+            except Exception as exc:
+                variant_rows = [
+                    {
+                        "variant": i,
+                        "params": json.dumps(variants[i], sort_keys=True),
+                        "error": f"{type(exc).__name__}: {exc}",
+                    }
+                ]
+            row = variant_rows[0]
+            print(
+                f"variant {i:4d}: {row.get('error') or row['outputs']}",
+                file=sys.stderr,
+            )
+            rows.extend(variant_rows)
+    # Sorted stably, so each variant's files stay in the order they were exported
+    return sorted(rows, key=lambda row: row["variant"])
+
+
+def write_summary(rows, output_dir):
+    output_dir = Path(output_dir)
+    json_path = output_dir / "sweep_summary.json"
+    csv_path = output_dir / "sweep_summary.csv"
+    json_path.write_text(json.dumps(rows, indent=2) + "\n")
+    fields = list(dict.fromkeys(key for row in rows for key in row))
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    return [csv_path, json_path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m model_tools.sweep",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("model", help="module name or path of the model script")
+    parser.add_argument(
+        "-g",
+        "--grid",
+        action="append",
+        default=[],
+        metavar="KEY=V1,V2,...",
+        help="values to sweep a parameter over; several are combined as a product",
+    )
+    parser.add_argument(
+        "--variants", type=Path, help="JSON file with a list of override dicts"
+    )
+    parser.add_argument(
+        "-o", "--output-dir", type=Path, default=Path("sweep"), help="(default: sweep)"
+    )
+    parser.add_argument(
+        "-j", "--processes", type=int, help="worker processes (default: one per CPU)"
+    )
+    parser.add_argument("-q", "--quality", choices=list(QUALITY_PROFILES))
+    parser.add_argument("--adaptive", action="store_true")
+    args = parser.parse_args(argv)
+
+    try:
+        variants = parse_grid(args.grid)
+    except ValueError as exc:
+        parser.error(exc.args[0])
+    if args.variants:
+        listed = json.loads(args.variants.read_text())
+        variants = (
+            listed
+            if not args.grid
+            else [
+                {**listed_variant, **grid_variant}
+                for listed_variant in listed
+                for grid_variant in variants
+            ]
+        )
+    if not variants:
+        parser.error(f"{args.variants} has no variants in it")
+
+    # Check the overrides up front, rather than have every worker fail
+    model = load_model(args.model)
+    for overrides in variants:
+        try:
+            apply_overrides(
+                model_params(model), [f"{k}={v!r}" for k, v in overrides.items()]
+            )
+        except (KeyError, ValueError) as exc:
+            parser.error(exc.args[0])
+
+    start = time.perf_counter()
+    rows = sweep(
+        args.model,
+        variants,
+        args.output_dir,
+        processes=args.processes,
+        quality=args.quality,
+        adaptive=args.adaptive,
+    )
+    for path in write_summary(rows, args.output_dir):
+        print(f"Wrote {path}")
+    failed = sum("error" in row for row in rows)
+    print(
+        f"{len(variants)} variants ({failed} failed) in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Select faces, edges and wires of a shape without re-measuring them for every query.
+
+``ShapeList.sort_by``, ``filter_by`` and ``group_by`` work out the center, normal, length
+or area of every shape each time they're called, which adds up quickly on the sketches
+made from STL meshes, with thousands of faces. ``TopologyIndex`` measures each shape once,
+keeping the values in NumPy arrays, and answers the same queries from those::
+
+    faces = TopologyIndex(sketch).faces
+    top = faces.sort_by(Axis.Z)[-1]
+    bottom = faces.sort_by(Axis.Z)[0]
+    walls = faces.filter_by(Axis.X) + faces.filter_by(Axis.Y)
+
+The results are ``IndexedShapeList``s, so queries chained on them reuse the same values.
+Unlike the rest of model_tools this imports build123d, as it's all about its shapes.
+"""
+
+import math
+from functools import cached_property
+
+import numpy as np
+from build123d import Axis, Face, GeomType, ShapeList, SortBy
+
+NOT_PARALLEL = np.full(3, np.nan)
+
+
+def direction(shape):
+    """The normal of a planar face, or the direction of a straight edge"""
+    if isinstance(shape, Face):
+        if shape.is_planar:
+            return tuple(shape.normal_at())
+    elif getattr(shape, "geom_type", None) == GeomType.LINE:
+        return tuple(shape.tangent_at(0))
+    return NOT_PARALLEL
+
+
+# How to measure each of the values the shapes are indexed by
+MEASURES = {
+    "center": lambda shapes: [tuple(shape.center()) for shape in shapes],
+    "direction": lambda shapes: [direction(shape) for shape in shapes],
+    "length": lambda shapes: [shape.length for shape in shapes],
+    "area": lambda shapes: [shape.area for shape in shapes],
+}
+
+
+class IndexedShapeList(ShapeList):
+    """A ShapeList measuring its shapes at most once for sort_by, filter_by and group_by
+
+    Only axes and SortBy.LENGTH, AREA and DISTANCE are answered from the index; anything
+    else falls back to the ShapeList methods.
+    """
+
+    def __init__(self, shapes=(), values=None):
+        super().__init__(shapes)
+        self._values = {} if values is None else values
+
+    def _measure(self, name):
+        if name not in self._values:
+            values = np.array(MEASURES[name](self), dtype=float)
+            if name in ("center", "direction"):
+                values = values.reshape(len(self), 3)
+            self._values[name] = values
+        return self._values[name]
+
+    def _keys(self, by):
+        """The value of each shape to sort or group by, or None if it isn't indexed"""
+        if isinstance(by, Axis):
+            origin = np.array(tuple(by.position))
+            return (self._measure("center") - origin) @ np.array(tuple(by.direction))
+        if by == SortBy.LENGTH:
+            return self._measure("length")
+        if by == SortBy.AREA:
+            return self._measure("area")
+        if by == SortBy.DISTANCE:
+            return np.linalg.norm(self._measure("center"), axis=1)
+        return None
+
+    def _subset(self, indices):
+        return IndexedShapeList(
+            [self[i] for i in indices],
+            {name: values[indices] for name, values in self._values.items()},
+        )
+
+    def sort_by(self, sort_by=Axis.Z, reverse=False):
+        keys = self._keys(sort_by) if len(self) else None
+        if keys is None:
+            return super().sort_by(sort_by, reverse)
+        # A stable sort, with equal shapes kept in order either way, like sorted()
+        order = np.argsort(-keys if reverse else keys, kind="stable")
+        return self._subset(order)
+
+    def filter_by(self, filter_by, reverse=False, tolerance=1e-5):
+        if not isinstance(filter_by, Axis) or not len(self):
+            return super().filter_by(filter_by, reverse, tolerance)
+        # Parallel, or anti-parallel, within the angular tolerance, which is in degrees
+        # like Axis.is_parallel's. The angle is worked out from both the sine and cosine,
+        # as the cosine alone can't tell angles this small apart from 0.
+        directions = self._measure("direction")
+        axis = np.array(tuple(filter_by.direction))
+        sines = np.linalg.norm(np.cross(directions, axis), axis=1)
+        cosines = np.abs(directions @ axis)
+        with np.errstate(invalid="ignore"):
+            parallel = np.arctan2(sines, cosines) <= math.radians(tolerance)
+        return self._subset(np.flatnonzero(~parallel if reverse else parallel))
+
+    def group_by(self, group_by=Axis.Z, reverse=False, tol_digits=6):
+        """Like ShapeList.group_by, but returns a plain list of the groups"""
+        keys = self._keys(group_by) if len(self) else None
+        if keys is None:
+            return list(super().group_by(group_by, reverse, tol_digits))
+        levels, labels = np.unique(np.round(keys, tol_digits), return_inverse=True)
+        groups = [self._subset(np.flatnonzero(labels == i)) for i in range(len(levels))]
+        return groups[::-1] if reverse else groups
+
+
+class TopologyIndex:
+    """The faces, edges and wires of a shape, each indexed on first use"""
+
+    def __init__(self, shape):
+        self.shape = shape
+
+    @cached_property
+    def faces(self):
+        return IndexedShapeList(self.shape.faces())
+
+    @cached_property
+    def edges(self):
+        return IndexedShapeList(self.shape.edges())
+
+    @cached_property
+    def wires(self):
+        return IndexedShapeList(self.shape.wires())
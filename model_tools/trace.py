@@ -0,0 +1,189 @@
+"""
+Record how long each named stage of a build takes.
+
+Wrap the interesting parts of a model in ``stage``, either as a context manager or as a
+decorator, and call ``report`` at the end to print a summary::
+
+    with stage("make_body"):
+        body = make_body(**body_vars)
+
+Besides the wall time, each stage records the CPU time it used and the peak resident
+memory of the process so far once it finished. That's the highest the process reached
+at any point before then, not the peak of the stage itself, which model_tools.memory
+measures. ``write_chrome_trace`` saves the stages as Chrome
+trace events, to be opened in https://ui.perfetto.dev or chrome://tracing.
+
+Set ``MODEL_TRACE=off`` (or ``trace.enabled = False``) to record nothing at all, in which
+case a stage costs little more than checking that flag. Stages also profile memory, when
+that's turned on (see model_tools.memory).
+"""
+
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from contextlib import ContextDecorator
+
+from model_tools import memory
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# process_peak_rss is the peak RSS of the process from its start up to the end of the
+# stage. pid is the process the stage ran in, as stages run in worker processes can be
+# added to the timings of the parent.
+Timing = namedtuple(
+    "Timing",
+    "name depth start seconds cpu_seconds process_peak_rss pid",
+    defaults=(None,),
+)
+
+enabled = os.environ.get("MODEL_TRACE", "").lower() not in ("off", "0", "false", "no")
+
+# A Timing for every finished stage
+timings = []
+# (stage, start, cpu start) for each of the stages currently running
+_running = []
+
+
+def peak_rss():
+    """The peak resident set size of this process so far in bytes, or 0 if unknown"""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, everything else kilobytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class stage(ContextDecorator):
+    """Time the enclosed block or decorated function, recording it under name"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if enabled:
+            _running.append((self, time.perf_counter(), time.process_time()))
+        if memory.enabled:
+            memory.stage_started(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        if memory.enabled:
+            memory.stage_finished(self)
+        # Check it's ours, in case tracing was turned on while the stage was running
+        if _running and _running[-1][0] is self:
+            _, start, cpu_start = _running.pop()
+            timings.append(
+                Timing(
+                    self.name,
+                    len(_running),
+                    start,
+                    time.perf_counter() - start,
+                    time.process_time() - cpu_start,
+                    peak_rss(),
+                    os.getpid(),
+                )
+            )
+        return False
+
+
+def reset():
+    timings.clear()
+
+
+def in_order():
+    """The recorded stages in the order they started, grouped by process"""
+    return sorted(timings, key=lambda timing: (timing.pid or 0, timing.start))
+
+
+def stage_paths():
+    """Return (path, seconds) for every recorded stage, where the path joins the names
+    of the stages enclosing it with "/", e.g. "build/make_body/fillet"."""
+    paths = []
+    stack = []
+    for timing in in_order():
+        del stack[timing.depth :]
+        stack.append(timing.name)
+        paths.append(("/".join(stack), timing.seconds))
+    return paths
+
+
+def chrome_trace_events():
+    """The recorded stages as Chrome trace events, with times in microseconds"""
+    if not timings:
+        return []
+    # perf_counter() is system wide on Linux, so the processes line up with each other
+    origin = min(timing.start for timing in timings)
+    name = os.path.basename(sys.argv[0]) or "python"
+    events = [
+        {
+            "name": "process_name",
+            "ph": "M",
+            "pid": pid,
+            "args": {"name": name if pid == os.getpid() else f"{name} worker"},
+        }
+        for pid in sorted({timing.pid or os.getpid() for timing in timings})
+    ]
+    for timing in in_order():
+        pid = timing.pid or os.getpid()
+        start = (timing.start - origin) * 1e6
+        end = start + timing.seconds * 1e6
+        events.append(
+            {
+                "name": timing.name,
+                "ph": "X",
+                "ts": start,
+                "dur": timing.seconds * 1e6,
+                "pid": pid,
+                "tid": 0,
+                "args": {
+                    "cpu_ms": round(timing.cpu_seconds * 1e3, 3),
+                    "process_peak_rss_mb": round(timing.process_peak_rss / 2**20, 1),
+                },
+            }
+        )
+        events.append(
+            {
+                "name": "process peak RSS (MB)",
+                "ph": "C",
+                "ts": end,
+                "pid": pid,
+                "args": {"peak": round(timing.process_peak_rss / 2**20, 1)},
+            }
+        )
+    return events
+
+
+def write_chrome_trace(path):
+    """Save the recorded stages as a Chrome trace JSON file"""
+    with open(path, "w", encoding="utf-8") as trace_file:
+        json.dump(
+            {"traceEvents": chrome_trace_events(), "displayTimeUnit": "ms"}, trace_file
+        )
+    return path
+
+
+def report(file=None):
+    """Print the recorded stages, indented by nesting, in the order they started"""
+    file = file or sys.stderr
+    if not timings:
+        return
+    # Stages are recorded as they finish, so a parent comes after its children
+    ordered = in_order()
+    width = max(len(timing.name) + timing.depth * 2 for timing in ordered)
+    print(
+        f"{'Stage timings:':<{width + 2}}  {'wall':>9}  {'cpu':>9}  "
+        f"{'process peak RSS':>16}",
+        file=file,
+    )
+    for timing in ordered:
+        label = "  " * timing.depth + timing.name
+        print(
+            f"  {label:<{width}}  {timing.seconds:8.3f}s  {timing.cpu_seconds:8.3f}s  "
+            f"{timing.process_peak_rss / 2**20:14.1f}MB",
+            file=file,
+        )
@@ -0,0 +1,164 @@
+"""
+Check tessellated meshes are closed, manifold solids before they're written out.
+
+An STL with holes in it, or with edges shared by more than two triangles, makes slicers
+guess, and their guesses can waste a whole print. The checks here work on the triangles
+with NumPy, so they only take a fraction of a second even for a full plate:
+
+- the vertices are welded first, as the triangles of neighbouring faces don't share them
+- every edge is keyed by its two vertices, and the keys sorted and counted: an edge only
+  one triangle has is on the edge of a hole, and one more than two have is non-manifold
+- an edge two triangles share should run one way in one and the other way in the other;
+  a triangle whose edges mostly run the same way as its neighbours' is flipped
+- a solid's volume has to be positive
+
+Triangles with no area are counted as degenerate, but aren't a problem on their own:
+OCC's meshing leaves the odd one, and slicers just drop them. They're left out of the
+checks above, so if that would open up the mesh it shows up as open edges.
+
+``validate`` runs the checks on the meshes of an export, and warns about the problems
+it finds or raises a ValueError, depending on the mode (see ``set_validation``)::
+
+    meshes = tessellate_all(shapes)
+    validate(meshes, [shape.label for shape in shapes])
+    write_stl(path, meshes)
+"""
+
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+VALIDATION_MODES = ("warn", "fail", "off")
+# How many decimal places of a mm vertices have to agree to in order to be welded
+WELD_DIGITS = 6
+# A triangle is degenerate if its area is less than this times its longest edge squared
+DEGENERATE_TOLERANCE = 1e-10
+
+# What to do about a mesh with problems, set from the command line with set_validation()
+DEFAULT_MODE = os.environ.get("MODEL_VALIDATE", "warn")
+if DEFAULT_MODE not in VALIDATION_MODES:
+    raise ValueError(
+        f"Unknown validation mode {DEFAULT_MODE!r} in MODEL_VALIDATE, expected one of "
+        + ", ".join(VALIDATION_MODES)
+    )
+validation = {"mode": DEFAULT_MODE}
+
+# boundary_edges: edges with only one triangle. non_manifold_edges: edges with more than
+# two. inconsistent_edges: edges whose two triangles disagree on which way they face.
+MeshCheck = namedtuple(
+    "MeshCheck",
+    "triangles boundary_edges non_manifold_edges inconsistent_edges "
+    "degenerate_triangles flipped_triangles volume",
+)
+
+
+def set_validation(mode=None):
+    """Set what validate() does about problems by default: warn, fail or off"""
+    if mode is not None and mode not in VALIDATION_MODES:
+        raise ValueError(f"Unknown validation mode {mode!r}")
+    validation["mode"] = mode or DEFAULT_MODE
+
+
+def welded_triangles(mesh, digits=WELD_DIGITS):
+    """The triangles of the mesh, with coincident vertices given the same index"""
+    keys = np.round(mesh.vertices, digits)
+    # Sorting the rows as plain integers is a lot quicker than np.unique(axis=0)
+    keys = np.ascontiguousarray(keys + 0.0).view(np.dtype((np.void, 24))).reshape(-1)
+    _, inverse = np.unique(keys, return_inverse=True)
+    return inverse.reshape(-1)[mesh.triangles], inverse.max() + 1
+
+
+def check_mesh(mesh, digits=WELD_DIGITS):
+    """Check a mesh is a closed, manifold and consistently outward facing solid"""
+    triangles, vertex_count = welded_triangles(mesh, digits)
+    corners = mesh.vertices[mesh.triangles]
+    sides = np.roll(corners, -1, axis=1) - corners
+    doubled_area = np.linalg.norm(np.cross(sides[:, 0], sides[:, 1]), axis=1)
+    longest = np.einsum("ijk,ijk->ij", sides, sides).max(axis=1)
+    degenerate = (
+        (triangles[:, 0] == triangles[:, 1])
+        | (triangles[:, 1] == triangles[:, 2])
+        | (triangles[:, 2] == triangles[:, 0])
+        | (doubled_area <= 2 * DEGENERATE_TOLERANCE * longest)
+    )
+    kept = np.flatnonzero(~degenerate)
+    triangles = triangles[kept]
+    if not len(triangles):
+        return MeshCheck(len(mesh.triangles), 0, 0, 0, len(mesh.triangles), 0, 0.0)
+
+    # Every directed edge, keyed by its vertices whichever way it runs
+    starts = triangles.reshape(-1)
+    ends = triangles[:, [1, 2, 0]].reshape(-1)
+    keys = np.minimum(starts, ends) * vertex_count + np.maximum(starts, ends)
+    order = np.argsort(keys, kind="stable")
+    new_edge = np.diff(keys[order], prepend=-1) != 0
+    first = np.flatnonzero(new_edge)
+    counts = np.diff(np.append(first, len(keys)))
+    # Two triangles facing the same way share an edge running opposite ways in each
+    forwards = np.add.reduceat((starts < ends)[order].astype(np.int64), first)
+    inconsistent = (counts == 2) & (forwards != 1)
+
+    # Triangles with two or more edges running the same way as their neighbours' are
+    # the flipped ones, rather than the neighbours
+    edge = np.empty(len(keys), dtype=np.int64)
+    edge[order] = np.cumsum(new_edge) - 1
+    wrong_way = np.bincount(
+        np.flatnonzero(inconsistent[edge]) // 3, minlength=len(triangles)
+    )
+
+    volume = np.einsum(
+        "ij,ij->i", corners[kept, 0], np.cross(corners[kept, 1], corners[kept, 2])
+    ).sum()
+    return MeshCheck(
+        len(mesh.triangles),
+        int(np.count_nonzero(counts == 1)),
+        int(np.count_nonzero(counts > 2)),
+        int(np.count_nonzero(inconsistent)),
+        int(np.count_nonzero(degenerate)),
+        int(np.count_nonzero(wrong_way >= 2)),
+        float(volume / 6),
+    )
+
+
+def problems(check):
+    """Describe what's wrong with a checked mesh, as a list of strings"""
+    found = []
+    if check.boundary_edges:
+        found.append(f"{check.boundary_edges} open edges")
+    if check.non_manifold_edges:
+        found.append(f"{check.non_manifold_edges} non-manifold edges")
+    if check.flipped_triangles or check.inconsistent_edges:
+        found.append(
+            f"{check.flipped_triangles} flipped triangles "
+            f"({check.inconsistent_edges} edges between triangles facing apart)"
+        )
+    if check.volume <= 0:
+        found.append(f"a volume of {check.volume:.3f}mm³, so it's inside out or flat")
+    return found
+
+
+def validate(meshes, labels=None, mode=None, file=None):
+    """Check each of the meshes before they're written, returning their MeshChecks
+
+    Problems are printed as warnings, or raised as a ValueError in "fail" mode. With
+    mode "off" (or set to it with set_validation) nothing is checked at all.
+    """
+    mode = mode or validation["mode"]
+    if mode == "off":
+        return []
+    file = file or sys.stderr
+    meshes = list(meshes)
+    labels = list(labels or [f"mesh {i + 1}" for i in range(len(meshes))])
+    checks = [check_mesh(mesh) for mesh in meshes]
+    reports = [
+        f"{label}: {', '.join(problems(check))}"
+        for label, check in zip(labels, checks)
+        if problems(check)
+    ]
+    if reports and mode == "fail":
+        raise ValueError("Invalid meshes:\n  " + "\n  ".join(reports))
+    for report in reports:
+        print(f"Warning: {report}", file=file)
+    return checks
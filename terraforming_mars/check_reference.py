@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Check how far the player mat parts have drifted from aimfeld's models they're based on.
+
+Each part is built by player_mat.py, tessellated, and compared with its source model in
+files/aimfeld, both centered the same way the parser centers them. The body is a
+narrower, minimal version of aimfeld's, so it never matches exactly: the per-region
+report shows where the differences are, and the limits are there to catch a change that
+makes them any worse, e.g.::
+
+    python terraforming_mars/check_reference.py --regions 4x2 --max-mean 0.5
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Make the shared model_tools package importable when run as a plain script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from model_tools import deviation
+from model_tools.instances import unlocated
+from model_tools.mesh import tessellate_all
+from model_tools.trace import report, stage
+from terraforming_mars.mesh_measurements import centered, import_mesh
+
+source_dir = Path(__file__).resolve().parent / "files" / "aimfeld"
+# The part built by player_mat.py for each of the source models
+references = {
+    "Body": source_dir / "player-mat-parts_-_body.stl",
+    "Big Grid": source_dir / "player-mat-parts_-_grid_big.stl",
+    "Small Grid 1": source_dir / "player-mat-parts_-_grid_small.stl",
+}
+
+
+def compare_parts(parts, samples=100_000):
+    """Compare each of the parts with its reference, returning {label: result}"""
+    # Compared where they were built, as they may have been turned to lay them out
+    with stage("tessellate"):
+        meshes = tessellate_all(unlocated(parts[label]) for label in references)
+    results = {}
+    for (label, path), mesh in zip(references.items(), meshes):
+        with stage(f"compare {label}"):
+            results[label] = deviation.compare(
+                centered(mesh), import_mesh(path), samples
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    deviation.add_arguments(parser)
+    args = parser.parse_args()
+
+    from terraforming_mars import player_mat
+
+    with stage("build"):
+        parts = player_mat.build()
+    results = compare_parts(parts, args.samples)
+    for label, result in results.items():
+        deviation.report(label, result, args.regions)
+    if args.json:
+        json.dump(
+            {
+                label: deviation.summary(result, args.regions)
+                for label, result in results.items()
+            },
+            args.json,
+            indent=2,
+        )
+    report()
+    sys.exit(0 if deviation.check(results, args.max_hausdorff, args.max_mean) else 1)
@@ -0,0 +1,214 @@
+"""
+Extract the player mat measurements straight from the STL triangles with NumPy.
+
+This is an alternative to the process_<obj> functions in player_mat_parser.py, which
+build OCC faces from the mesh and fuse them into a Sketch before measuring anything. Here
+the triangles are instead clustered by their normals and Z levels, and the outlines of
+the flat patches (the top, the bottom, the bin floors) are found from their boundary
+edges. The measurements are the same as the parser's, so the resulting dicts can be used
+interchangeably.
+"""
+
+import statistics
+
+import numpy as np
+
+from model_tools.mesh import (
+    Mesh,
+    boundary_edges,
+    connected_components,
+    read_stl,
+    triangle_normals,
+)
+
+# How far from a level (in mm) a vertex can be and still count as on it
+LEVEL_TOLERANCE = 1e-3
+
+
+def import_mesh(path):
+    """Read an STL file and return its Mesh centered on x,y, with z starting at 0.0"""
+    return centered(read_stl(path))
+
+
+def centered(mesh):
+    """Move a Mesh to be centered on x,y, with z starting at 0.0, like import_model"""
+    vertices, triangles = mesh
+    low, high = vertices.min(axis=0), vertices.max(axis=0)
+    offset = (low + high) / 2
+    offset[2] = low[2]
+    return Mesh(vertices - offset, triangles)
+
+
+class Outline:
+    """The bounding box of a closed loop of boundary edges"""
+
+    def __init__(self, points):
+        self.points = points
+        self.min = points.min(axis=0)
+        self.max = points.max(axis=0)
+        self.size = self.max - self.min
+        self.center = (self.min + self.max) / 2
+        self.area = self.size[0] * self.size[1]
+
+
+def flat_triangles(mesh, z, facing):
+    """Mask of the triangles lying flat at height z, facing up (+1) or down (-1)"""
+    vertices, triangles = mesh
+    normals = triangle_normals(vertices, triangles)
+    on_level = np.abs(vertices[triangles][:, :, 2] - z).max(axis=1) < LEVEL_TOLERANCE
+    return on_level & (normals[:, 2] * facing > 1 - 1e-6)
+
+
+def levels(mesh, facing):
+    """The distinct Z heights of the flat triangles facing up (+1) or down (-1)"""
+    vertices, triangles = mesh
+    normals = triangle_normals(vertices, triangles)
+    flat = normals[:, 2] * facing > 1 - 1e-6
+    heights = vertices[triangles[flat]][:, :, 2].mean(axis=1)
+    return np.unique(np.round(heights / LEVEL_TOLERANCE) * LEVEL_TOLERANCE)
+
+
+def patches(mesh, mask):
+    """Split the masked triangles into connected patches, as lists of triangle indices"""
+    selected = np.flatnonzero(mask)
+    if not len(selected):
+        return []
+    labels = connected_components(mesh.triangles[selected], len(mesh.vertices))
+    return [selected[labels == label] for label in range(labels.max() + 1)]
+
+
+def outlines(mesh, mask):
+    """The outlines of the masked triangles, largest first
+
+    For a single patch this is its outer boundary, followed by the holes in it.
+    """
+    edges = boundary_edges(mesh.triangles[mask])
+    labels = connected_components(edges, len(mesh.vertices))
+    loops = [
+        Outline(mesh.vertices[np.unique(edges[labels == label])][:, :2])
+        for label in range(labels.max() + 1)
+    ]
+    return sorted(loops, key=lambda loop: loop.area, reverse=True)
+
+
+def corner_radius(outline):
+    """The radius of the rounded corners of a rectangular outline
+
+    This is how far in from the side of the rectangle the straight bottom edge starts.
+    """
+    points = outline.points
+    bottom_edge = points[np.abs(points[:, 1] - outline.min[1]) < LEVEL_TOLERANCE]
+    return bottom_edge[:, 0].min() - outline.min[0]
+
+
+def measure_body(mesh):
+    """Return the body_vars dict for the body mesh, as process_body would"""
+    vertices = mesh.vertices
+    z_min, z_max = vertices[:, 2].min(), vertices[:, 2].max()
+
+    top = outlines(mesh, flat_triangles(mesh, z_max, 1))[0]
+    body_height = z_max - z_min
+    body_length = top.size[0]
+
+    # The holes through the bottom, sans the border around the whole bottom
+    bottom_holes = outlines(mesh, flat_triangles(mesh, z_min, -1))[1:]
+    by_area = sorted(bottom_holes, key=lambda hole: hole.area)
+    hole_corner_radius = corner_radius(by_area[0])
+
+    # The two smallest holes are the inner holes, and the next two the upper and lower
+    # middle holes, which bound the width of the new, narrower body.
+    holes = by_area[:2]
+    lower, upper = sorted(by_area[2:4], key=lambda hole: hole.center[1])
+    body_y_top = upper.min[1]
+    body_y_bottom = lower.max[1]
+    body_width = body_y_top - body_y_bottom
+    body_center = np.array(
+        [(top.min[0] + top.max[0]) / 2, (body_y_top + body_y_bottom) / 2]
+    )
+
+    # The bins are recessed into the top, so their floors are the highest level below
+    # it. Any patches at that level reaching the edge of the top aren't bins.
+    bin_level = levels(mesh, 1)[levels(mesh, 1) < z_max - LEVEL_TOLERANCE].max()
+    floor_mask = flat_triangles(mesh, bin_level, 1)
+    bins = []
+    for patch in patches(mesh, floor_mask):
+        mask = np.zeros(len(mesh.triangles), dtype=bool)
+        mask[patch] = True
+        outline = outlines(mesh, mask)[0]
+        if np.all(outline.min > top.min + LEVEL_TOLERANCE) and np.all(
+            outline.max < top.max - LEVEL_TOLERANCE
+        ):
+            bins.append(outline)
+    bins.sort(key=lambda outline: outline.area)
+    bin_depth = z_max - bin_level
+
+    # The bins should all be the same length, but they vary in teensy ways, and all but
+    # the tall one have the same height.
+    bin_length = statistics.median([float(b.size[0]) for b in bins])
+    small_bin_height = statistics.median([float(b.size[1]) for b in bins[:-1]])
+    large_bin_height = float(bins[-1].size[1])
+    bin_lengths = [bin_length] * len(bins)
+    bin_heights = [small_bin_height] * (len(bins) - 1) + [large_bin_height]
+    bin_positions = [b.center - body_center for b in bins]
+
+    return {
+        "long_side": float(body_length),
+        "short_side": float(body_width),
+        "height": float(body_height),
+        "corner_radius": float(hole_corner_radius * 2),
+        "hole_sizes": [(float(h.size[0]), float(h.size[1])) for h in holes],
+        "hole_positions": [
+            (float(pos[0]), float(pos[1]))
+            for pos in [hole.center - body_center for hole in holes]
+        ],
+        "hole_corner_radius": float(hole_corner_radius),
+        "bin_sizes": list(zip(bin_lengths, bin_heights)),
+        "bin_positions": [(float(pos[0]), float(pos[1])) for pos in bin_positions],
+        "bin_depth": float(bin_depth),
+    }
+
+
+def measure_grid(mesh):
+    """Return the grid vars dict for a grid mesh, as process_grid would"""
+    vertices = mesh.vertices
+    z_min, z_max = vertices[:, 2].min(), vertices[:, 2].max()
+    grid_length, grid_width, grid_height = vertices.max(axis=0) - vertices.min(axis=0)
+
+    top_outlines = outlines(mesh, flat_triangles(mesh, z_max, 1))
+    bottom = outlines(mesh, flat_triangles(mesh, z_min, -1))[0]
+
+    # The cells are the holes in the top, in columns from left to right
+    cells = sorted(
+        top_outlines[1:], key=lambda cell: (round(cell.center[0], 1), cell.center[1])
+    )
+    cell_size = statistics.median([float(val) for cell in cells for val in cell.size])
+
+    x_count = int(grid_length // cell_size)
+    y_count = int(grid_width // cell_size)
+
+    first_column, second_column = cells[:y_count], cells[y_count : y_count * 2]
+    x_cell_spacing = min(c.min[0] for c in second_column) - max(
+        c.max[0] for c in first_column
+    )
+    first_cell, second_cell = first_column[:2]
+    y_cell_spacing = second_cell.min[1] - first_cell.max[1]
+
+    # The last column is separated from the rest, so the top is two separate areas
+    left_grid_length = (cell_size + x_cell_spacing) * (x_count - 1) + x_cell_spacing
+    right_grid_length = cell_size + x_cell_spacing * 2
+
+    return {
+        "long_side": float(grid_length),
+        "short_side": float(grid_width),
+        "height": float(grid_height),
+        "left_area_long_side": float(left_grid_length),
+        "right_area_long_side": float(right_grid_length),
+        "bottom_offset": float(
+            min(grid_length - bottom.size[0], grid_width - bottom.size[1])
+        ),
+        "x_count": x_count,
+        "y_count": y_count,
+        "x_spacing": float(cell_size + x_cell_spacing),
+        "y_spacing": float(cell_size + y_cell_spacing),
+        "cell_size": cell_size,
+    }
@@ -0,0 +1,93 @@
+"""
+The player mat parameters, as extracted by player_mat_parser.py and used by player_mat.py.
+
+They are stored in player_mat_params.json together with the SHA-256 of each source model
+they were measured from, so the parser only needs to re-parse the models that changed.
+This module deliberately has no heavy imports: checking whether the parameters are up to
+date only costs hashing the source files.
+"""
+
+import json
+import os
+import tempfile
+from numbers import Number
+from pathlib import Path
+
+from model_tools.cache import file_sha256
+
+# Bump this when the format or meaning of the measurements changes, to force a re-parse
+PARAMS_VERSION = 1
+PARAMS_FILE = Path(__file__).with_name("player_mat_params.json")
+
+# The parameters measured from each of the source models
+VAR_NAMES = {
+    "body_model": "body_vars",
+    "big_grid_model": "big_grid_vars",
+    "small_grid_model": "small_grid_vars",
+}
+
+
+def as_tuples(value):
+    """Turn JSON lists of numbers back into the tuples build123d expects"""
+    if isinstance(value, dict):
+        return {k: as_tuples(v) for k, v in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(v, Number) for v in value):
+            return tuple(value)
+        return [as_tuples(v) for v in value]
+    return value
+
+
+def load_params(path=PARAMS_FILE):
+    """Load the parameters file, returning an empty one if it is missing or outdated"""
+    try:
+        with open(path, encoding="utf-8") as params_file:
+            params = json.load(params_file)
+    except FileNotFoundError:
+        params = {}
+    if params.get("version") != PARAMS_VERSION:
+        return {"version": PARAMS_VERSION, "sources": {}}
+    return {key: as_tuples(value) for key, value in params.items()}
+
+
+def measured_params(path=PARAMS_FILE):
+    """Load the parameters file for building the player mat, raising an error saying
+    to run the parser if it is missing, outdated or lacks any of the measurements"""
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(
+            f"{path} is missing, run terraforming_mars/player_mat_parser.py to "
+            "measure the source models"
+        )
+    params = load_params(path)
+    missing = [name for name in VAR_NAMES.values() if name not in params]
+    if missing:
+        raise ValueError(
+            f"{path} is outdated or has no {', '.join(missing)}, run "
+            "terraforming_mars/player_mat_parser.py to measure the source models again"
+        )
+    return params
+
+
+def save_params(params, path=PARAMS_FILE):
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as params_file:
+        json.dump(params, params_file, indent=4)
+        params_file.write("\n")
+    os.replace(tmp_name, path)
+
+
+def stale_sources(params, source_files, engine):
+    """Return {name: sha256} for the source models that need to be (re-)parsed"""
+    stale = {}
+    for name, path in source_files.items():
+        sha256 = file_sha256(path)
+        recorded = params["sources"].get(name, {})
+        if (
+            recorded.get("sha256") != sha256
+            or recorded.get("engine") != engine
+            or VAR_NAMES[name] not in params
+        ):
+            stale[name] = sha256
+    return stale
@@ -6,62 +6,38 @@ Build a minimal Terraforming Mars Player Mat from scratch, based on values extra
 """
 
 import copy
+import sys
+from pathlib import Path
+
+# Make the shared model_tools package importable when run as a plain script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
 from build123d import *
-from ocp_vscode import *
-
-# Body Variables
-body_vars = {
-    "long_side": 213.3,
-    "short_side": 60.5,
-    "height": 3.0,
-    "corner_radius": 2.0,
-    "hole_sizes": [(19.0, 26.8), (120.5, 10.5)],
-    "hole_positions": [(-91.0, 13.4), (42.2, 0.0)],
-    "hole_corner_radius": 1.0,
-    "bin_sizes": [
-        (57.8, 19.5),
-        (57.8, 19.5),
-        (57.8, 19.5),
-        (57.8, 19.5),
-        (57.8, 19.5),
-        (57.8, 28.8),
-    ],
-    "bin_positions": [
-        (68.3, -18.0),
-        (1.5, -18.0),
-        (73.1, 18.0),
-        (-66.8, -18.0),
-        (12.9, 18.0),
-        (-49.9, 13.3),
-    ],
-    "bin_depth": 2.6,
-}
-
-# Big Grid Variables
-big_grid_vars = {
-    "long_side": 57.8,
-    "short_side": 28.8,
-    "height": 2.4,
-    "left_area_long_side": 47.4,
-    "right_area_long_side": 10.2,
-    "bottom_offset": 0.4,
-    "x_count": 6,
-    "y_count": 3,
-    "x_spacing": 9.3,
-    "y_spacing": 9.3,
-    "cell_size": 8.4,
-}
-
-# Small Grid Variables
-small_grid_vars = copy.copy(big_grid_vars)
-small_grid_vars.update(
-    {
-        "short_side": 19.5,
-        "y_count": 2,
-    }
+
+from model_tools.cache import part_cache
+from model_tools.instances import group_instances, location_matrix
+from model_tools.mesh import tessellate_all, transformed, write_3mf, write_stl
+from model_tools.nesting import (
+    layout_of,
+    nest_shapes,
+    plate_of,
+    report as report_layout,
 )
+from model_tools.topology import TopologyIndex
+from model_tools.trace import stage
+from model_tools.validate import validate
+from terraforming_mars.params import measured_params
+
+# The variables extracted from the source models by player_mat_parser.py
+params = measured_params()
+body_vars = params["body_vars"]
+big_grid_vars = params["big_grid_vars"]
+small_grid_vars = params["small_grid_vars"]
 
 
+# Building the parts is by far the slowest bit, so they are cached on disk keyed by
+# their parameters. Set MODEL_CACHE=off to always rebuild them.
+@part_cache.cached
 def make_body(
     long_side,
     short_side,
@@ -75,35 +51,43 @@ def make_body(
     bin_depth,
 ):
     with BuildPart() as body:
-        with BuildSketch() as sketch:
-            base = RectangleRounded(long_side, short_side, radius=corner_radius)
-            locs = Locations(*hole_positions)
-            for size, loc in zip(hole_sizes, locs):
-                with Locations(loc):
-                    RectangleRounded(
-                        *size, radius=hole_corner_radius, mode=Mode.SUBTRACT
-                    )
-        extrude(amount=height)
-        hole_wires = (
-            body.faces().sort_by(Axis.Z)[-1].wires().sort_by(SortBy.LENGTH)[:-1]
-        )
-        fillet(
-            [edge for wire in [wire.edges() for wire in hole_wires] for edge in wire],
-            radius=hole_corner_radius,
-        )
-        fillet(
-            body.faces().sort_by(Axis.Z)[-1].wires().sort_by(SortBy.LENGTH)[-1].edges(),
-            radius=corner_radius,
-        )
-        with BuildSketch(Plane.XY.offset(height)) as bins_sketch:
-            locs = Locations(*bin_positions)
-            for size, loc in zip(bin_sizes, locs):
-                with Locations(loc):
-                    Rectangle(*size)
-        extrude(amount=-bin_depth, mode=Mode.SUBTRACT)
+        with stage("sketch"):
+            with BuildSketch() as sketch:
+                base = RectangleRounded(long_side, short_side, radius=corner_radius)
+                locs = Locations(*hole_positions)
+                for size, loc in zip(hole_sizes, locs):
+                    with Locations(loc):
+                        RectangleRounded(
+                            *size, radius=hole_corner_radius, mode=Mode.SUBTRACT
+                        )
+        with stage("extrude"):
+            extrude(amount=height)
+        with stage("fillet"):
+            # The outline of the top face is untouched by filleting the holes, so its
+            # edges are still there for the second fillet and the top face only has to
+            # be found once.
+            top = TopologyIndex(body.part).faces.sort_by(Axis.Z)[-1]
+            *hole_wires, outline = TopologyIndex(top).wires.sort_by(SortBy.LENGTH)
+            fillet(
+                [
+                    edge
+                    for wire in [wire.edges() for wire in hole_wires]
+                    for edge in wire
+                ],
+                radius=hole_corner_radius,
+            )
+            fillet(outline.edges(), radius=corner_radius)
+        with stage("bins"):
+            with BuildSketch(Plane.XY.offset(height)) as bins_sketch:
+                locs = Locations(*bin_positions)
+                for size, loc in zip(bin_sizes, locs):
+                    with Locations(loc):
+                        Rectangle(*size)
+            extrude(amount=-bin_depth, mode=Mode.SUBTRACT)
     return body.part
 
 
+@part_cache.cached
 def make_grid(
     long_side,
     height,
@@ -116,92 +100,170 @@ def make_grid(
     x_spacing,
     y_spacing,
     cell_size,
+    batch_cells=True,
 ):
+    # Cutting the cells out of the sketch leaves the chamfer below working through a
+    # solid with every cell's walls in it, which gets very slow for big grids. With
+    # batch_cells the cells are instead kept aside, and cut out of the chamfered block
+    # as one compound in a single boolean. Either way the result is the same.
+    cell_mode = Mode.PRIVATE if batch_cells else Mode.SUBTRACT
+    top_plane = Plane.XY.offset(height)
     with BuildPart() as grid:
-        with BuildSketch(Plane.XY.offset(height)) as top_sk:
-            # Create the top face of the entire grid
-            rect = Rectangle(long_side, short_side)
-            # Get the lower left and upper right corners of the grid for use in creating the
-            # inner grid areas
-            lower_left = rect.vertices().sort_by(Axis.X)[0]
-            upper_right = rect.vertices().sort_by(Axis.X)[-1]
-            # We need to create the left and right areas just to use as location references
-            # for the GridLocations below
-            with Locations(lower_left):
-                left_rect = Rectangle(
-                    left_area_long_side, short_side, align=Align.MIN, mode=Mode.PRIVATE
-                )
-            with Locations(upper_right):
-                right_rect = Rectangle(
-                    right_area_long_side, short_side, align=Align.MAX, mode=Mode.PRIVATE
-                )
-            with Locations(left_rect.center()):
-                with GridLocations(
-                    x_spacing, y_spacing, x_count - 1, y_count
-                ) as l_locs:
-                    cells = Rectangle(cell_size, cell_size, mode=Mode.SUBTRACT)
-            with Locations(right_rect.center()):
-                with GridLocations(x_spacing, y_spacing, 1, y_count) as r_locs:
-                    cells = Rectangle(cell_size, cell_size, mode=Mode.SUBTRACT)
-        extrude(amount=-height)
-        chamfer(
-            grid.faces().sort_by(Axis.Z)[0].outer_wire().edges(),
-            length=height - 0.1,
-            length2=bottom_offset,
-        )
+        with stage("sketch"):
+            with BuildSketch(top_plane) as top_sk:
+                # Create the top face of the entire grid
+                rect = Rectangle(long_side, short_side)
+                # Get the lower left and upper right corners of the grid for use in
+                # creating the inner grid areas
+                lower_left = rect.vertices().sort_by(Axis.X)[0]
+                upper_right = rect.vertices().sort_by(Axis.X)[-1]
+                # We need to create the left and right areas just to use as location
+                # references for the GridLocations below
+                with Locations(lower_left):
+                    left_rect = Rectangle(
+                        left_area_long_side,
+                        short_side,
+                        align=Align.MIN,
+                        mode=Mode.PRIVATE,
+                    )
+                with Locations(upper_right):
+                    right_rect = Rectangle(
+                        right_area_long_side,
+                        short_side,
+                        align=Align.MAX,
+                        mode=Mode.PRIVATE,
+                    )
+                with Locations(left_rect.center()):
+                    with GridLocations(
+                        x_spacing, y_spacing, x_count - 1, y_count
+                    ) as l_locs:
+                        left_cells = Rectangle(cell_size, cell_size, mode=cell_mode)
+                with Locations(right_rect.center()):
+                    with GridLocations(x_spacing, y_spacing, 1, y_count) as r_locs:
+                        right_cells = Rectangle(cell_size, cell_size, mode=cell_mode)
+        with stage("extrude"):
+            extrude(amount=-height)
+        with stage("chamfer"):
+            chamfer(
+                grid.faces().sort_by(Axis.Z)[0].outer_wire().edges(),
+                length=height - 0.1,
+                length2=bottom_offset,
+            )
+        if batch_cells:
+            with stage("cut cells"):
+                # Private sketch objects aren't placed on the sketch plane for us. The
+                # cutters also stick out of the top and bottom, as faces lying in the
+                # same plane as the top or bottom would make the boolean much slower.
+                cutter_plane = top_plane.offset(1)
+                cells = [
+                    cutter_plane * face
+                    for face in left_cells.faces() + right_cells.faces()
+                ]
+                extrude(cells, amount=-(height + 2), mode=Mode.SUBTRACT)
     return grid.part
 
 
-body = make_body(**body_vars)
-grid_big = make_grid(**big_grid_vars)
-grid_small = make_grid(**small_grid_vars)
-
-body.label = "Body"
-grid_big.label = "Big Grid"
-grid_small.label = "Small Grid 1"
-
-# show(body, grid_big, grid_small, names=["body", "big grid", "small grid"])
-
-# Layout all the parts
-
-# Leave the body in the center, and put three small grids on the -Y side, and the big
-# grid + two small grids on the +Y side.
-grids = [grid_big, grid_small]
-for i in range(4):
-    grid = copy.copy(grid_small)
-    grid.label = f"Small Grid {i+2}"
-    grids.append(grid)
-
-
-x_locs = [
-    body.bounding_box().min.X + small_grid_vars["long_side"] / 2,
-    body.bounding_box().center().X,
-    body.bounding_box().max.X - big_grid_vars["long_side"] / 2,
-] * 2  # x val is same for upper and lower grids
-y_locs = (
-    [body.bounding_box().max.Y + small_grid_vars["short_side"]]
-    + [
-        body.bounding_box().max.Y
-        + small_grid_vars["short_side"]
-        + (big_grid_vars["short_side"] - small_grid_vars["short_side"]) / 2
-    ]
-    * 2  # The upper small grids placements need to be adjusted to match the short_side of the big grid.
-    + [body.bounding_box().min.Y - small_grid_vars["short_side"]] * 3
-)
+def build(
+    body_vars=body_vars,
+    big_grid_vars=big_grid_vars,
+    small_grid_vars=small_grid_vars,
+    sets=1,
+    bed_size=(256, 256),
+    spacing=5,
+):
+    with stage("make_body"):
+        body = make_body(**body_vars)
+    with stage("make_grid big"):
+        grid_big = make_grid(**big_grid_vars)
+    with stage("make_grid small"):
+        grid_small = make_grid(**small_grid_vars)
+
+    # A set is the body, the big grid and five small grids. The first set keeps the
+    # plain labels, so its parts can be looked up the same however many are printed.
+    parts = []
+    for number in range(1, sets + 1):
+        suffix = "" if number == 1 else f" (set {number})"
+        templates = [(body, "Body"), (grid_big, "Big Grid")] + [
+            (grid_small, f"Small Grid {i}") for i in range(1, 6)
+        ]
+        for template, label in templates:
+            part = copy.copy(template)
+            part.label = label + suffix
+            parts.append(part)
+
+    # Pack the parts onto as few build plates as they fit on
+    with stage("layout"):
+        nest_shapes(parts, bed_size, spacing)
+
+    return {part.label: part for part in parts}
+
+
+def show_parts(parts):
+    from ocp_vscode import Camera, show
+
+    body, *grids = parts.values()
+    show(body, grids, reset_camera=Camera.KEEP)
+
+
+def export(parts, output_dir=".", formats=("stl",)):
+    output_dir = Path(output_dir)
+    test_path = output_dir / "terraforming_mars_player_mat_small_grid.stl"
+    plate_path = output_dir / "terraforming_mars_player_mat_with_grids"
+    paths = []
+
+    layout = layout_of(parts.values())
+    if layout:
+        report_layout(layout)
+
+    # The small grids are all copies of the same geometry, so each unique part is only
+    # tessellated once, each in its own worker process, and then placed as needed.
+    groups = group_instances(parts.values())
+    with stage("tessellate"):
+        meshes = tessellate_all(group.prototype for group in groups)
+    # Every copy of a part has the same triangles, so only the unique parts are checked
+    with stage("validate"):
+        validate(meshes, [group.prototype.label for group in groups])
+
+    if "stl" in formats:
+        # Export just one small grid for a test print
+        with stage("write test grid"):
+            grid = groups[-1].instances[-1]
+            mesh = transformed(meshes[-1], location_matrix(grid))
+            paths.append(write_stl(test_path, [mesh]))
+
+    # Then each build plate, with the parts as build() laid them out on it. Parts that
+    # weren't laid out are all on the one plate, where they are.
+    plate_count = max(plate_of(part) for part in parts.values()) + 1
+    for plate in range(plate_count):
+        path = plate_path
+        if plate_count > 1:
+            path = path.with_name(f"{path.name}_plate{plate + 1}")
+        objects = []
+        for group, mesh in zip(groups, meshes):
+            instances = [part for part in group.instances if plate_of(part) == plate]
+            if instances:
+                transforms = [location_matrix(part) for part in instances]
+                objects.append((instances[0].label, mesh, transforms))
+
+        if "stl" in formats:
+            # All the parts on the plate go in one file, placing each copy only as
+            # it's written, so there's only ever one placed copy in memory
+            placed = (
+                transformed(mesh, matrix)
+                for _, mesh, transforms in objects
+                for matrix in transforms
+            )
+            with stage("write plate"):
+                paths.append(write_stl(path.with_suffix(".stl"), placed))
+
+        if "3mf" in formats:
+            # Each unique part is written once, with a build item for every copy of it
+            with stage("write 3mf"):
+                paths.append(write_3mf(path.with_suffix(".3mf"), objects))
+    return paths
+
+
+if __name__ == "__main__":
+    from model_tools.cli import main
 
-locs = [Pos(x, y) for x, y in zip(x_locs, y_locs)]
-for i, grid in enumerate(grids):
-    grid.locate(locs[i])
-
-show(body, grids, reset_camera=Camera.KEEP)
-
-# Export the parts
-exporter = Mesher()
-exporter.add_shape(grids[-1])
-# Export just one small grid for a test print
-exporter.write("terraforming_mars_player_mat_small_grid.stl")
-# Then export the the body and all the grids in one file
-exporter.add_shape(body)
-for grid in grids[:-1]:
-    exporter.add_shape(grid)
-exporter.write("terraforming_mars_player_mat_with_grids.stl")
+    main(sys.modules[__name__])
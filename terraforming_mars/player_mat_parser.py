@@ -7,25 +7,52 @@ turn is based on aimfeld's https://www.thingiverse.com/thing:2988374 which is wh
 script uses as the source for the measurements.
 """
 
+import argparse
+import os
 import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import combinations
+from pathlib import Path
 from pprint import pformat
 
-from build123d import *
-from ocp_vscode import *
+# Make the shared model_tools package importable when run as a plain script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from model_tools import memory, trace
+from model_tools.fuse import tree_fuse
+from model_tools.mesh import read_stl, shape_to_brep
+from model_tools.mesh_faces import planar_faces
+from model_tools.trace import stage
+from terraforming_mars.mesh_measurements import import_mesh, measure_body, measure_grid
+from terraforming_mars.params import (
+    VAR_NAMES,
+    load_params,
+    save_params,
+    stale_sources,
+)
 
 # aimfeld models
+source_dir = Path(__file__).resolve().parent / "files" / "aimfeld"
 source_files = dict(
-    body_model="./files/aimfeld/player-mat-parts_-_body.stl",
-    big_grid_model="./files/aimfeld/player-mat-parts_-_grid_big.stl",
-    small_grid_model="./files/aimfeld/player-mat-parts_-_grid_small.stl",
+    body_model=source_dir / "player-mat-parts_-_body.stl",
+    big_grid_model=source_dir / "player-mat-parts_-_grid_big.stl",
+    small_grid_model=source_dir / "player-mat-parts_-_grid_small.stl",
 )
 
 
-def import_model(path):
-    """Import an STL file and return the model(s) centered on x,y, with z=0.0"""
-    importer = Mesher()
-    models = importer.read(path)
+def import_model(path, merge_coplanar=True):
+    """Import an STL file and return the model(s) centered on x,y, with z=0.0
+
+    By default the coplanar triangles are merged into polygon faces, leaving far fewer
+    faces to fuse than the Mesher's one face per triangle.
+    """
+    from build123d import CenterOf, Compound, Mesher, Pos
+
+    if merge_coplanar:
+        models = [Compound(planar_faces(read_stl(path)))]
+    else:
+        models = Mesher().read(path)
     for model in models:
         c = model.center(CenterOf.BOUNDING_BOX)
         c.Z *= 2
@@ -39,17 +66,22 @@ def import_model(path):
 
 
 def process_body(model):
-    # The body has too many curves to be quickly merged, so we'll just focus on the
-    # straight Axis faces.
-    sk = (
-        Sketch()
-        + model.faces().filter_by(Axis.X)
-        + model.faces().filter_by(Axis.Y)
-        + model.faces().filter_by(Axis.Z)
+    from build123d import Axis, Pos, Rectangle, ShapeList, Sketch, SortBy
+
+    from model_tools.topology import TopologyIndex
+
+    # We'll just focus on the straight Axis faces. Merging the coplanar triangles doesn't
+    # do much for the curves, which are still a face per facet, and every one of those
+    # would add a level to the group_by(Axis.Z) below, throwing off which of the groups
+    # are the top, bins and bottom. There are still thousands of faces, so they're
+    # indexed once rather than measured all over again for each axis.
+    faces = TopologyIndex(model).faces
+    sk = tree_fuse(
+        faces.filter_by(Axis.X) + faces.filter_by(Axis.Y) + faces.filter_by(Axis.Z)
     )
     yield sk
 
-    grouped_by_z = sk.faces().group_by(Axis.Z)
+    grouped_by_z = TopologyIndex(sk).faces.group_by(Axis.Z)
     top = Sketch() + grouped_by_z[-1]
     bins = Sketch() + (grouped_by_z[1] + grouped_by_z[-2]).sort_by(SortBy.DISTANCE)[:-4]
     bottom = Sketch() + grouped_by_z[0]
@@ -107,11 +139,10 @@ def process_body(model):
     )
 
     # These are all the same, but we get the median anyway. Why not!
-    bin_depth = statistics.median(
-        [face.length for face in bins.faces().filter_by(Axis.X)]
-    )
+    bin_faces = TopologyIndex(bins).faces
+    bin_depth = statistics.median([face.length for face in bin_faces.filter_by(Axis.X)])
 
-    bin_z_faces = bins.faces().filter_by(Axis.Z).sort_by(SortBy.AREA)
+    bin_z_faces = bin_faces.filter_by(Axis.Z).sort_by(SortBy.AREA)
     # The bins should all be the same length, but they vary in teensy ways.
     bin_length = statistics.median([face.length for face in bin_z_faces])
 
@@ -143,22 +174,27 @@ def process_body(model):
 
 
 def process_grid(model):
+    from build123d import Axis, Face, Sketch, SortBy
+
+    from model_tools.topology import IndexedShapeList, TopologyIndex
+
     # This model is small enough I can just stitch the whole thing together quickly and
     # work from that.
-    sk = Sketch() + model.faces()
+    sk = tree_fuse(model.faces())
     yield (sk)
 
     grid_length, grid_width, grid_height = sk.bounding_box().size
     # There is a chamfer we'll need to calculate from the bottom to the top.
 
-    top = sk.faces().sort_by(Axis.Z)[-1]
-    bottom = sk.faces().sort_by(Axis.Z)[0]
+    faces_by_z = TopologyIndex(sk).faces.sort_by(Axis.Z)
+    top = faces_by_z[-1]
+    bottom = faces_by_z[0]
 
     cells = (
-        ShapeList(
+        IndexedShapeList(
             [
                 Face.make_from_wires(cell)
-                for cell in top.wires().sort_by(SortBy.LENGTH)[:-1]
+                for cell in TopologyIndex(top).wires.sort_by(SortBy.LENGTH)[:-1]
             ]
         )
         .sort_by(SortBy.DISTANCE)
@@ -236,19 +272,167 @@ def print_vars(vars, name=None):
     print(f"{output}\n}}\n")
 
 
-def print_all_vars():
+def print_all_vars(params):
     for name in ["Body", "Big Grid", "Small Grid"]:
         var_name = f"{name.lower().replace(' ', '_')}_vars"
-        vars = round_data(globals()[var_name], precision=1)
+        vars = round_data(params[var_name], precision=1)
         print_vars(vars, name=name)
 
 
-body_model = next(import_model(source_files["body_model"]))
-big_grid_model = next(import_model(source_files["big_grid_model"]))
-small_grid_model = next(import_model(source_files["small_grid_model"]))
+def parse_model(name, path, engine):
+    """Extract the vars dict from one of the source models, returning it along with the
+    reduced sketch it was measured from (None with the numpy engine)"""
+    if engine == "numpy":
+        with stage("import"):
+            mesh = import_mesh(path)
+        with stage("measure"):
+            measure = measure_body if name == "body_model" else measure_grid
+            return measure(mesh), None
+    with stage("import"):
+        model = next(import_model(path))
+    memory.record_shape(model, label=f"{name} faces")
+    process = process_body if name == "body_model" else process_grid
+    # The process functions yield the reduced sketch first, then the measurements
+    steps = process(model)
+    with stage("reduce"):
+        sketch = next(steps)
+    memory.record_shape(sketch, label=f"{name} sketch")
+    with stage("measure"):
+        return next(steps), sketch
+
+
+def parse_source(name, path, engine, trace_stages=False, profile_memory=False):
+    """Worker function: parse one source model in its own process, returning its vars,
+    its reduced sketch as BREP bytes (or None), the stage timings and the memory
+    profile as (stages, shapes)"""
+    trace.enabled = trace_stages
+    trace.reset()
+    memory.enabled = profile_memory
+    memory.reset()
+    with stage(name):
+        vars, sketch = parse_model(name, path, engine)
+    brep = None if sketch is None else shape_to_brep(sketch)
+    return vars, brep, trace.timings, (memory.stages, memory.shapes)
+
+
+def parse_sources(names, engine, processes):
+    """Parse the named source models, yielding (name, vars, sketch BREP or None)
+
+    With more than one process, each model is parsed in its own worker process, so it
+    takes about as long as the slowest of them rather than all of them in turn.
+    """
+    if processes <= 1 or len(names) <= 1:
+        for name in names:
+            print(f"Parsing {source_files[name].name}")
+            with stage(name):
+                vars, sketch = parse_model(name, source_files[name], engine)
+            yield name, vars, None if sketch is None else shape_to_brep(sketch)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(processes, len(names))) as pool:
+        futures = {}
+        for name in names:
+            print(f"Parsing {source_files[name].name}")
+            future = pool.submit(
+                parse_source,
+                name,
+                source_files[name],
+                engine,
+                trace.enabled,
+                memory.enabled,
+            )
+            futures[future] = name
+        for future in as_completed(futures):
+            vars, brep, timings, (memory_stages, shapes) = future.result()
+            # The workers' stages are shown alongside this process's
+            trace.timings.extend(timings)
+            memory.stages.extend(memory_stages)
+            memory.shapes.extend(shapes)
+            yield futures[future], vars, brep
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--engine",
+        choices=["occ", "numpy"],
+        default="occ",
+        help="build OCC faces from the meshes and measure those (occ), or measure the "
+        "STL triangles directly with NumPy, which is much faster (numpy)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="re-parse all the models, even if they haven't changed",
+    )
+    parser.add_argument(
+        "--print",
+        action="store_true",
+        help="print the variables as Python literals too",
+    )
+    parser.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        default=1,
+        help="parse the models in this many worker processes, one model each (0: one "
+        "per CPU)",
+    )
+    parser.add_argument(
+        "--sketch-dir",
+        type=Path,
+        metavar="DIR",
+        help="save the reduced sketches the occ engine measures as BREP files in DIR",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        metavar="FILE",
+        help="save the stage timings as a Chrome trace (see https://ui.perfetto.dev)",
+    )
+    parser.add_argument(
+        "--memory",
+        type=Path,
+        metavar="FILE",
+        help="profile the memory used by each stage, and by the imported faces and "
+        "reduced sketches, saving it as JSON",
+    )
+    args = parser.parse_args()
+    if args.trace:
+        trace.enabled = True
+    memory.enabled = bool(args.memory)
+
+    # Only the models that changed since the parameters were last saved are parsed
+    params = load_params()
+    if args.force:
+        params["sources"] = {}
+    stale = stale_sources(params, source_files, args.engine)
+    processes = args.processes or os.cpu_count() or 1
+    for name, vars, brep in parse_sources(list(stale), args.engine, processes):
+        params[VAR_NAMES[name]] = round_data(vars, precision=1)
+        params["sources"][name] = {
+            "path": str(
+                source_files[name].relative_to(Path(__file__).resolve().parent)
+            ),
+            "sha256": stale[name],
+            "engine": args.engine,
+        }
+        if args.sketch_dir and brep:
+            args.sketch_dir.mkdir(parents=True, exist_ok=True)
+            sketch_path = args.sketch_dir / f"{name}.brep"
+            sketch_path.write_bytes(brep)
+            print(f"Wrote {sketch_path}")
+    if stale:
+        save_params(params)
+        print("Saved the parameters")
+    else:
+        print("The parameters are up to date")
 
-source_body, body_vars = list(process_body(body_model))
-source_big_grid, big_grid_vars = list(process_grid(big_grid_model))
-source_small_grid, small_grid_vars = list(process_grid(small_grid_model))
+    if args.print:
+        print_all_vars(params)
 
-print_all_vars()
+    trace.report()
+    if args.trace:
+        print(f"Wrote {trace.write_chrome_trace(args.trace)}")
+    if args.memory:
+        print(f"Wrote {memory.write_json(args.memory)}")
@@ -0,0 +1,63 @@
+"""IndexedShapeList has to select the same shapes as the ShapeList queries it replaces"""
+
+import pytest
+from build123d import (
+    Axis,
+    Box,
+    Compound,
+    Cylinder,
+    Face,
+    Pos,
+    Rectangle,
+    ShapeList,
+    SortBy,
+)
+
+from model_tools.topology import IndexedShapeList
+
+
+def make_shape():
+    # Planar faces along every axis, curved ones, and faces just off the axes
+    shapes = [Box(10, 20, 5), Pos(0, 0, 5) * Cylinder(3, 4)]
+    for degrees in (1e-6, 1e-4, 0.5):
+        face = Rectangle(2, 2).faces()[0].rotate(Axis.X, degrees)
+        shapes.append(Pos(20 + 100 * degrees, 0, 0) * face)
+    return Compound(shapes)
+
+
+@pytest.fixture(scope="module", params=["faces", "edges"])
+def shapes(request):
+    return getattr(make_shape(), request.param)()
+
+
+def same(indexed, plain):
+    return [id(shape) for shape in indexed] == [id(shape) for shape in plain]
+
+
+@pytest.mark.parametrize("by", [Axis.X, Axis.Y, Axis.Z, SortBy.LENGTH, SortBy.AREA])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_sort_by(shapes, by, reverse):
+    if by == (SortBy.LENGTH if isinstance(shapes[0], Face) else SortBy.AREA):
+        pytest.skip("only edges have a length, and only faces an area")
+    indexed = IndexedShapeList(shapes).sort_by(by, reverse)
+    assert same(indexed, ShapeList(shapes).sort_by(by, reverse))
+
+
+@pytest.mark.parametrize("axis", [Axis.X, Axis.Y, Axis.Z])
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("tolerance", [1e-5, 1e-3, 1])
+def test_filter_by(shapes, axis, reverse, tolerance):
+    indexed = IndexedShapeList(shapes).filter_by(axis, reverse, tolerance)
+    assert same(indexed, ShapeList(shapes).filter_by(axis, reverse, tolerance))
+
+
+@pytest.mark.parametrize("axis", [Axis.X, Axis.Y, Axis.Z])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_group_by(shapes, axis, reverse):
+    indexed = IndexedShapeList(shapes).group_by(axis, reverse)
+    plain = ShapeList(shapes).group_by(axis, reverse)
+    assert len(indexed) == len(plain)
+    for indexed_group, plain_group in zip(indexed, plain):
+        assert {id(shape) for shape in indexed_group} == {
+            id(shape) for shape in plain_group
+        }